@@ -1,5 +1,6 @@
 import urllib.request
-from urllib.parse import urlparse, quote, parse_qs
+import urllib.error
+from urllib.parse import urlparse, urljoin, quote, parse_qs, parse_qsl, urlencode
 import re
 import os
 from datetime import datetime, timedelta, timezone
@@ -7,9 +8,23 @@ import opencc
 import ssl
 import sys
 import socket
+import ipaddress
+import sqlite3
 import time
+import json
+import hashlib
+import struct
+import heapq
+import bisect
+import itertools
+import zlib
+import functools
+import threading
+import asyncio
+import argparse
 import concurrent.futures
-from typing import List, Dict, Set, Tuple
+from collections import Counter, deque
+from typing import List, Dict, Set, Tuple, Optional, Iterable, NamedTuple, Callable
 
 # 跳过SSL证书验证
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -23,6 +38,14 @@ sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)
 
 print("脚本开始执行")
 
+# 源抓取并发参数
+FETCH_MAX_WORKERS = 16       # 抓取线程总数
+FETCH_PER_HOST_LIMIT = 4     # 单个主机同时进行的请求数上限（未使用共用调度器时）
+FETCH_TIMEOUT = 10           # 单个源的下载超时（秒）
+
+# 本地缓存目录（由 GitHub Actions 的 cache 步骤在多次运行之间保留）
+CACHE_DIR = '.cache'
+
 # 读取文本方法
 def read_txt_to_array(file_name: str) -> List[str]:
     encodings = ['utf-8-sig', 'gbk', 'latin-1']
@@ -50,8 +73,33 @@ def read_list_from_txt(file_path: str, is_blacklist: bool = True) -> List[str]:
             result.append(line)
     return result
 
+# 频道字典：分类 -> 频道列表，同时维护 频道名 -> 分类 的索引
+class ChannelDictionaries(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rebuild_index()
+
+    # 按分类顺序建立索引，同名频道归属优先级最高（最先出现）的分类
+    def rebuild_index(self) -> None:
+        self.index = {}
+        for category, channel_names in self.items():
+            for channel_name in channel_names:
+                self.index.setdefault(channel_name, category)
+
+    def category_of(self, channel_name: str) -> Optional[str]:
+        return self.index.get(channel_name)
+
+# 查找频道所属分类
+def find_channel_category(channel_name: str, channel_dictionaries: Dict[str, List[str]]) -> Optional[str]:
+    if isinstance(channel_dictionaries, ChannelDictionaries):
+        return channel_dictionaries.category_of(channel_name)
+    for category, dictionary in channel_dictionaries.items():
+        if channel_name in dictionary:
+            return category
+    return None
+
 # 读取频道字典
-def load_channel_dictionaries() -> Dict[str, List[str]]:
+def load_channel_dictionaries() -> ChannelDictionaries:
     dictionaries = {}
     categories = {
         'zh': '主频道/综合频道.txt',
@@ -63,17 +111,34 @@ def load_channel_dictionaries() -> Dict[str, List[str]]:
         'gd': '地方台/广东频道.txt',
         'hain': '地方台/海南频道.txt'
     }
+
+    # 其余地方台以文件名（如 "上海频道"）作为分类，优先级排在上面的分类之后
+    local_dir = '地方台'
+    if os.path.isdir(local_dir):
+        known_paths = set(categories.values())
+        for file_name in sorted(os.listdir(local_dir)):
+            path = f"{local_dir}/{file_name}"
+            if file_name.endswith('.txt') and path not in known_paths:
+                categories[file_name[:-4]] = path
     
     for key, path in categories.items():
         dictionaries[key] = read_txt_to_array(path)
     
-    return dictionaries
+    return ChannelDictionaries(dictionaries)
+
+# 简繁转换器只创建一次，所有频道行共用
+_t2s_converter = None
+
+def get_t2s_converter():
+    global _t2s_converter
+    if _t2s_converter is None:
+        _t2s_converter = opencc.OpenCC('t2s')
+    return _t2s_converter
 
 # 简繁转换
 def traditional_to_simplified(text: str) -> str:
     try:
-        converter = opencc.OpenCC('t2s')
-        return converter.convert(text)
+        return get_t2s_converter().convert(text)
     except Exception as e:
         print(f"简繁转换出错: {e}")
         return text
@@ -100,21 +165,31 @@ def process_m3u_content(text: str) -> str:
 # 清理频道名称
 removal_list = ["「IPV4」", "「IPV6」", "[ipv6]", "[ipv4]", "_电信", "电信", "（HD）", "[超清]", "高清", "超清", "-HD", "(HK)", "AKtv", "@", "IPV6", "🎞🎞🎞🎞🎞🎞🎞🎞️", "🎦🎦🎦🎦🎦🎦🎦🎦", " ", "[BD]", "[VGA]", "[HD]", "[SD]", "(1080p)", "(720p)", "(480p)"]
 
+name_replacements = {
+    "CCTV0": "CCTV-",
+    "PLUS": "+",
+    "NewTV-": "NewTV",
+    "iHOT-": "iHOT",
+    "NEW": "New",
+    "New_": "New"
+}
+
+# 逐项删除再逐项替换：前一项处理后拼接起来的文字可能匹配后面的项，所以按顺序逐项处理，
+# 重复名称的开销由 normalize_channel_name 的缓存消除
 def clean_channel_name(channel_name: str) -> str:
     for item in removal_list:
         channel_name = channel_name.replace(item, "")
-    replacements = {
-        "CCTV0": "CCTV-",
-        "PLUS": "+",
-        "NewTV-": "NewTV",
-        "iHOT-": "iHOT",
-        "NEW": "New",
-        "New_": "New"
-    }
-    for old, new in replacements.items():
+    for old, new in name_replacements.items():
         channel_name = channel_name.replace(old, new)
     return channel_name
 
+# 原始名称 -> 规范名称，同一个原始名称会在几十个源里反复出现，结果做有界缓存
+NAME_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def normalize_channel_name(raw_name: str) -> str:
+    return clean_channel_name(traditional_to_simplified(raw_name))
+
 # 生成频道ID（用于EPG和LOGO）
 def generate_channel_id(channel_name: str) -> str:
     # 处理CCTV频道
@@ -128,110 +203,2008 @@ def generate_channel_id(channel_name: str) -> str:
     channel_id = re.sub(r'[^\w]', '', channel_name)
     return channel_id
 
-# 直播源验证函数
-def validate_stream_url(url: str, timeout: int = 3) -> Tuple[bool, float]:
-    try:
+# DNS缓存：验证开始前并行预解析所有主机，之后的探测直接使用缓存地址
+DNS_CACHE_TTL = 600          # 解析结果有效期（秒）
+DNS_PREFETCH_WORKERS = 64    # 预解析线程数
+
+class DnsCache:
+    def __init__(self, ttl: float = DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}  # 主机 -> (地址列表, 过期时间)，解析失败时地址列表为空
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def is_ip_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def _lookup(self, host: str) -> List[str]:
+        try:
+            infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        except (socket.gaierror, UnicodeError, OSError):
+            addresses = []
+        with self.lock:
+            self.lookups += 1
+            self.entries[host] = (addresses, time.time() + self.ttl)
+        return addresses
+
+    def _cached(self, host: str) -> Optional[List[str]]:
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is not None and entry[1] > time.time():
+                self.hits += 1
+                return entry[0]
+        return None
+
+    # 返回主机的IPv4地址列表；解析失败返回空列表
+    def resolve(self, host: str) -> List[str]:
+        if self.is_ip_address(host):
+            return [host]
+        host = host.lower()
+        addresses = self._cached(host)
+        return addresses if addresses is not None else self._lookup(host)
+
+    # 异步版本：缓存未命中时在线程池中解析，不阻塞事件循环上的其他探测
+    async def resolve_async(self, host: str) -> List[str]:
+        if self.is_ip_address(host):
+            return [host]
+        host = host.lower()
+        addresses = self._cached(host)
+        if addresses is not None:
+            return addresses
+        return await asyncio.get_running_loop().run_in_executor(None, self._lookup, host)
+
+    def prefetch(self, hosts: Iterable[str], max_workers: int = DNS_PREFETCH_WORKERS) -> None:
+        now = time.time()
+        with self.lock:
+            pending = sorted({host.lower() for host in hosts if host and not self.is_ip_address(host)}
+                             - {host for host, entry in self.entries.items() if entry[1] > now})
+        if not pending:
+            return
         start_time = time.time()
-        
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
-        
-        # TCP连接测试
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            list(executor.map(self._lookup, pending))
+        failed = [host for host in pending if not self.entries[host][0]]
+        print(f"DNS预解析: {len(pending)} 个主机, 解析失败 {len(failed)} 个, 耗时 {time.time() - start_time:.2f} 秒")
+
+    def failed_hosts(self) -> List[str]:
+        with self.lock:
+            return sorted(host for host, entry in self.entries.items() if not entry[0])
+
+    def summary(self) -> str:
+        return f"DNS缓存: 实际解析 {self.lookups} 次, 复用缓存 {self.hits} 次, 解析失败主机 {len(self.failed_hosts())} 个"
+
+# 请求调度：源下载和直播源探测共用，限制每个主机的并发数，并用全局令牌桶限制每秒请求数
+REQUEST_RATE_LIMIT = 200           # 全局每秒请求数上限，None 表示不限
+REQUEST_BURST = 50                 # 令牌桶容量（允许的瞬时突发请求数）
+HOST_CONCURRENCY_LIMIT = 6         # 单个主机同时进行的请求数上限
+HOST_CONCURRENCY_OVERRIDES = {     # 个别主机单独设置并发上限
+    'raw.githubusercontent.com': 8
+}
+
+class RequestScheduler:
+    def __init__(self, rate: Optional[float] = REQUEST_RATE_LIMIT, burst: int = REQUEST_BURST,
+                 per_host_limit: int = HOST_CONCURRENCY_LIMIT, host_limits: Optional[Dict[str, int]] = None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.per_host_limit = max(1, per_host_limit)
+        self.host_limits = {host.lower(): max(1, limit) for host, limit in (host_limits if host_limits is not None else HOST_CONCURRENCY_OVERRIDES).items()}
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.active = Counter()
+        self.waiters = {}  # 主机 -> 等待并发名额的唤醒函数队列
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.stats = {}    # 阶段 -> [请求数, 累计等待秒数, 最长等待秒数]
+
+    def _limit_for(self, host: str) -> int:
+        return self.host_limits.get(host, self.per_host_limit)
+
+    # 预约一个令牌，返回需要等待的秒数（令牌可以透支，等待时间按欠额计算）
+    def _reserve_token(self) -> float:
+        if self.rate is None:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # 尝试占用主机名额；名额已满时登记唤醒函数并返回 False
+    def _try_take_slot(self, host: str, wake) -> bool:
+        if self.active[host] < self._limit_for(host):
+            self.active[host] += 1
+            return True
+        self.waiters.setdefault(host, deque()).append(wake)
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return False
+
+    # 释放名额；有等待者时直接把名额交给队首
+    def release(self, host: str) -> None:
+        with self.lock:
+            waiters = self.waiters.get(host)
+            if waiters:
+                wake = waiters.popleft()
+                self.queue_depth -= 1
+                if not waiters:
+                    del self.waiters[host]
+            else:
+                self.active[host] -= 1
+                return
+        wake()
+
+    def _record(self, stage: str, waited: float) -> None:
+        with self.lock:
+            entry = self.stats.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += waited
+            entry[2] = max(entry[2], waited)
+
+    # 同步获取：用于下载线程和线程池探测
+    def acquire(self, host: str, stage: str = 'fetch') -> None:
+        start_time = time.monotonic()
+        host = host.lower()
+        event = threading.Event()
+        with self.lock:
+            has_slot = self._try_take_slot(host, event.set)
+        if not has_slot:
+            event.wait()
+        with self.lock:
+            delay = self._reserve_token()
+        if delay > 0:
+            time.sleep(delay)
+        self._record(stage, time.monotonic() - start_time)
+
+    # 异步获取：用于异步验证引擎，唤醒可以来自其他线程
+    async def acquire_async(self, host: str, stage: str = 'probe') -> None:
+        start_time = time.monotonic()
+        host = host.lower()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self.lock:
+            has_slot = self._try_take_slot(host, wake)
+        if not has_slot:
+            try:
+                await future
+            except asyncio.CancelledError:
+                # 已经被分配名额时要交还，否则从等待队列中移除
+                with self.lock:
+                    waiters = self.waiters.get(host)
+                    still_waiting = waiters is not None and wake in waiters
+                    if still_waiting:
+                        waiters.remove(wake)
+                        self.queue_depth -= 1
+                if not still_waiting:
+                    self.release(host)
+                raise
+        with self.lock:
+            delay = self._reserve_token()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release(host)
+                raise
+        self._record(stage, time.monotonic() - start_time)
+
+    def summary(self) -> str:
+        lines = [f"请求调度: 最大排队 {self.max_queue_depth} 个请求"]
+        for stage, (count, total_wait, max_wait) in sorted(self.stats.items()):
+            average = total_wait / count if count else 0.0
+            lines.append(f"  {stage}: {count} 次请求, 平均等待 {average * 1000:.0f} ms, 最长等待 {max_wait:.2f} 秒")
+        return '\n'.join(lines)
+
+# 直播源验证函数：连接、TLS握手和带 Range 的 GET 在同一个连接上完成
+def validate_stream_url(url: str, timeout: int = 3, dns_cache: Optional[DnsCache] = None) -> Tuple[bool, float]:
+    result = probe_stream_url(url, timeout, dns_cache)
+    return result.ok, result.latency
+
+# 异步验证参数
+VALIDATION_ENGINE = 'async'        # 'async' 使用异步验证引擎，'thread' 使用原来的线程池
+VALIDATION_TIMEOUT = 3             # 单次探测各阶段的超时（秒）
+VALIDATION_CONCURRENCY = 500       # 同时进行中的探测数上限
+VALIDATION_MAX_REDIRECTS = 5
+
+# HLS深度探测：解析播放列表并下载首个分片，按实际下载速率排序
+VALIDATION_DEEP_PROBE = False      # 是否对 .m3u8 地址做深度探测
+DEEP_PROBE_TIMEOUT = 10            # 单个地址深度探测的总超时（秒）
+DEEP_PROBE_MAX_PLAYLIST_BYTES = 1024 * 1024
+DEEP_PROBE_MAX_SEGMENT_BYTES = 2 * 1024 * 1024
+RANKING_METRIC = 'latency'         # 'latency' 按响应时间排序，'ttfb' 按服务器首字节时间（不含握手）排序，'throughput' 按深度探测的下载速率排序
+
+STREAM_CONTENT_TYPES = ['video', 'audio', 'application/octet-stream', 'application/vnd.apple.mpegurl']
+
+# HLS深度探测得到的播放能力指标
+class StreamQuality(NamedTuple):
+    ttfb: float                        # 首个分片的首字节时间（秒）
+    throughput: float                  # 首个分片的下载速率（字节/秒）
+    bandwidth: Optional[int] = None    # 播放列表声明的码率（bit/s）
+    resolution: Optional[str] = None   # 播放列表声明的分辨率
+
+# 单次探测各阶段耗时（秒）；非 https 地址 tls 为 0
+class ProbeTimings(NamedTuple):
+    connect: float
+    tls: float
+    ttfb: float    # 请求发出到收到完整响应头
+
+# 探测结果；error 记录失败阶段：dns / connect / http / content-type / timeout / error
+class ProbeResult(NamedTuple):
+    ok: bool
+    latency: Optional[float]
+    error: str = ''
+    quality: Optional[StreamQuality] = None
+    timings: Optional[ProbeTimings] = None
+
+# 建立连接阶段（DNS / TCP / TLS）的失败，与连接建立后的HTTP失败区分开
+class ProbeConnectError(Exception):
+    def __init__(self, phase: str, cause: BaseException):
+        super().__init__(f"{phase}: {cause!r}")
+        self.phase = phase
+        self.cause = cause
+
+# 不校验证书，与全局 ssl 设置保持一致
+def create_probe_ssl_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+PROBE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Connection': 'close',
+    'Range': 'bytes=0-1024'
+}
+
+# 组装 HTTP/1.1 GET 请求
+def build_http_request(url: str, headers: Dict[str, str]) -> bytes:
+    parsed = urlparse(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+    target = quote(path, safe="/?&=%;:+,@!$'()*~[]#")
+    host_header = parsed.netloc.rsplit('@', 1)[-1]
+    request_lines = [f"GET {target} HTTP/1.1", f"Host: {host_header}"]
+    request_lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ('\r\n'.join(request_lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+
+# 解析响应头，返回 (状态码, 小写键的响应头)
+def parse_http_head(raw_head: bytes) -> Tuple[int, Dict[str, str]]:
+    head_lines = raw_head.decode('latin-1').split('\r\n')
+    status = int(head_lines[0].split(' ', 2)[1])
+    response_headers = {}
+    for line in head_lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers
+
+# 取得连接用的地址，解析失败时抛出 ProbeConnectError('dns')
+def resolve_probe_host(host: str, dns_cache: Optional[DnsCache]) -> str:
+    if dns_cache is None:
+        return host
+    addresses = dns_cache.resolve(host)
+    if not addresses:
+        raise ProbeConnectError('dns', socket.gaierror(f"cannot resolve {host}"))
+    return addresses[0]
+
+async def resolve_probe_host_async(host: str, dns_cache: Optional[DnsCache], timeout: float) -> str:
+    if dns_cache is None:
+        return host
+    try:
+        addresses = await asyncio.wait_for(dns_cache.resolve_async(host), timeout=timeout)
+    except asyncio.TimeoutError as e:
+        raise ProbeConnectError('dns', e)
+    if not addresses:
+        raise ProbeConnectError('dns', socket.gaierror(f"cannot resolve {host}"))
+    return addresses[0]
+
+# 同步单连接探测：TCP连接、TLS握手、GET 依次在同一个 socket 上进行，分别计时
+def probe_stream_url(url: str, timeout: float = VALIDATION_TIMEOUT, dns_cache: Optional[DnsCache] = None, ssl_context: Optional[ssl.SSLContext] = None) -> ProbeResult:
+    ssl_context = ssl_context or create_probe_ssl_context()
+    start_time = time.time()
+    current_url = url
+    try:
+        for _ in range(VALIDATION_MAX_REDIRECTS + 1):
+            parsed = urlparse(current_url)
+            host = parsed.hostname
+            if not host:
+                return ProbeResult(False, None, 'error')
+            port = parsed.port or DEFAULT_PORTS.get(parsed.scheme, 80)
+            use_tls = parsed.scheme == 'https'
+
+            phase_start = time.time()
+            try:
+                sock = socket.create_connection((resolve_probe_host(host, dns_cache), port), timeout=timeout)
+            except socket.gaierror:
+                return ProbeResult(False, None, 'dns')
+            except OSError:
+                return ProbeResult(False, None, 'connect')
+            connect_time = time.time() - phase_start
+
+            try:
+                # 非HTTP协议只做TCP连接测试
+                if parsed.scheme not in ('http', 'https'):
+                    return ProbeResult(True, time.time() - start_time, timings=ProbeTimings(connect_time, 0.0, 0.0))
+
+                tls_time = 0.0
+                if use_tls:
+                    phase_start = time.time()
+                    try:
+                        sock = ssl_context.wrap_socket(sock, server_hostname=host)
+                    except (OSError, ssl.SSLError):
+                        return ProbeResult(False, None, 'connect')
+                    tls_time = time.time() - phase_start
+
+                phase_start = time.time()
+                sock.sendall(build_http_request(current_url, PROBE_HEADERS))
+                raw_head = b''
+                while b'\r\n\r\n' not in raw_head:
+                    chunk = sock.recv(4096)
+                    if not chunk or len(raw_head) > 65536:
+                        return ProbeResult(False, None, 'http')
+                    raw_head += chunk
+                ttfb = time.time() - phase_start
+            finally:
+                sock.close()
+
+            status, response_headers = parse_http_head(raw_head.split(b'\r\n\r\n', 1)[0])
+            if status in (301, 302, 303, 307, 308) and response_headers.get('location'):
+                current_url = urljoin(current_url, response_headers['location'])
+                if urlparse(current_url).scheme not in ('http', 'https'):
+                    return ProbeResult(False, None, 'http')
+                continue
+            if status not in (200, 206):
+                return ProbeResult(False, None, 'http')
+            content_type = response_headers.get('content-type', '')
+            if not any(x in content_type for x in STREAM_CONTENT_TYPES):
+                return ProbeResult(False, None, 'content-type')
+            return ProbeResult(True, time.time() - start_time, timings=ProbeTimings(connect_time, tls_time, ttfb))
+
+        return ProbeResult(False, None, 'http')
+    except ProbeConnectError as e:
+        return ProbeResult(False, None, e.phase)
+    except socket.timeout:
+        return ProbeResult(False, None, 'timeout')
+    except (OSError, ValueError, IndexError):
+        return ProbeResult(False, None, 'http')
+    except Exception:
+        return ProbeResult(False, None, 'error')
+
+# 异步建立连接：先完成TCP连接，再在同一个 socket 上做TLS握手，分别计时
+async def async_open_connection(host: str, port: int, use_tls: bool, timeout: float, ssl_context: ssl.SSLContext,
+                                dns_cache: Optional[DnsCache] = None) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, float, float]:
+    loop = asyncio.get_running_loop()
+    connect_host = await resolve_probe_host_async(host, dns_cache, timeout)
+    phase_start = time.time()
+    sock = None
+    try:
+        if not DnsCache.is_ip_address(connect_host):
+            infos = await asyncio.wait_for(loop.getaddrinfo(connect_host, port, family=socket.AF_INET, type=socket.SOCK_STREAM), timeout=timeout)
+            connect_host = infos[0][4][0]
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        result = sock.connect_ex((host, port))
+        sock.setblocking(False)
+        await asyncio.wait_for(loop.sock_connect(sock, (connect_host, port)), timeout=timeout)
+    except socket.gaierror as e:
+        if sock is not None:
+            sock.close()
+        raise ProbeConnectError('dns', e)
+    except (OSError, asyncio.TimeoutError) as e:
+        if sock is not None:
+            sock.close()
+        raise ProbeConnectError('connect', e)
+    connect_time = time.time() - phase_start
+
+    phase_start = time.time()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(sock=sock, ssl=ssl_context if use_tls else None, server_hostname=host if use_tls else None),
+            timeout=timeout
+        )
+    except (OSError, asyncio.TimeoutError) as e:
         sock.close()
-        
-        if result != 0:
-            return False, None
-            
-        # HTTP/HTTPS验证
-        if url.startswith(('http://', 'https://')):
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*',
-                'Connection': 'close',
-                'Range': 'bytes=0-1024'
-            }
-            
-            req = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req, timeout=timeout) as response:
-                if response.getcode() not in [200, 206]:
-                    return False, None
-                
-                content_type = response.headers.get('Content-Type', '')
-                if not any(x in content_type for x in ['video', 'audio', 'application/octet-stream', 'application/vnd.apple.mpegurl']):
-                    return False, None
-                    
-        end_time = time.time()
-        return True, end_time - start_time
-        
-    except Exception as e:
-        return False, None
+        raise ProbeConnectError('connect', e)
+    tls_time = time.time() - phase_start if use_tls else 0.0
+    return reader, writer, connect_time, tls_time
+
+# 异步HTTP请求：发送 GET 并读取到响应头为止，返回 (状态码, 响应头, reader, writer, 各阶段耗时)
+async def async_http_request(url: str, headers: Dict[str, str], timeout: float, ssl_context: ssl.SSLContext,
+                             dns_cache: Optional[DnsCache] = None) -> Tuple[int, Dict[str, str], asyncio.StreamReader, asyncio.StreamWriter, ProbeTimings]:
+    parsed = urlparse(url)
+    host = parsed.hostname
+    port = parsed.port or DEFAULT_PORTS.get(parsed.scheme, 80)
+    use_tls = parsed.scheme == 'https'
+
+    reader, writer, connect_time, tls_time = await async_open_connection(host, port, use_tls, timeout, ssl_context, dns_cache)
+    try:
+        phase_start = time.time()
+        writer.write(build_http_request(url, headers))
+        await writer.drain()
+        raw_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=timeout)
+        ttfb = time.time() - phase_start
+        status, response_headers = parse_http_head(raw_head[:-4])
+        return status, response_headers, reader, writer, ProbeTimings(connect_time, tls_time, ttfb)
+    except BaseException:
+        writer.close()
+        raise
+
+async def close_writer(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+# 异步直播源验证：与 validate_stream_url 相同的判断规则，返回 (是否有效, 响应时间)
+async def validate_stream_url_async(url: str, timeout: float = VALIDATION_TIMEOUT, ssl_context: Optional[ssl.SSLContext] = None, dns_cache: Optional[DnsCache] = None) -> ProbeResult:
+    ssl_context = ssl_context or create_probe_ssl_context()
+    start_time = time.time()
+    try:
+        parsed_url = urlparse(url)
+        if not parsed_url.hostname:
+            return ProbeResult(False, None, 'error')
+
+        # 非HTTP协议只做TCP连接测试
+        if parsed_url.scheme not in ('http', 'https'):
+            port = parsed_url.port or DEFAULT_PORTS.get(parsed_url.scheme, 80)
+            try:
+                _, writer, connect_time, _ = await async_open_connection(parsed_url.hostname, port, False, timeout, ssl_context, dns_cache)
+            except ProbeConnectError as e:
+                return ProbeResult(False, None, e.phase)
+            await close_writer(writer)
+            return ProbeResult(True, time.time() - start_time, timings=ProbeTimings(connect_time, 0.0, 0.0))
+
+        headers = PROBE_HEADERS
+        current_url = url
+        for _ in range(VALIDATION_MAX_REDIRECTS + 1):
+            try:
+                status, response_headers, _, writer, timings = await async_http_request(current_url, headers, timeout, ssl_context, dns_cache)
+            except ProbeConnectError as e:
+                return ProbeResult(False, None, e.phase)
+            except asyncio.TimeoutError:
+                return ProbeResult(False, None, 'timeout')
+            except OSError:
+                return ProbeResult(False, None, 'http')
+            await close_writer(writer)
+
+            if status in (301, 302, 303, 307, 308) and response_headers.get('location'):
+                current_url = urljoin(current_url, response_headers['location'])
+                if urlparse(current_url).scheme not in ('http', 'https'):
+                    return ProbeResult(False, None, 'http')
+                continue
+
+            if status not in (200, 206):
+                return ProbeResult(False, None, 'http')
+
+            content_type = response_headers.get('content-type', '')
+            if not any(x in content_type for x in STREAM_CONTENT_TYPES):
+                return ProbeResult(False, None, 'content-type')
+
+            return ProbeResult(True, time.time() - start_time, timings=timings)
+
+        return ProbeResult(False, None, 'http')
+
+    except (ValueError, IndexError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return ProbeResult(False, None, 'http')
+    except Exception:
+        return ProbeResult(False, None, 'error')
+
+# 读取响应体，支持 Content-Length / chunked / 读到连接关闭，最多读取 max_bytes
+async def read_http_body(reader: asyncio.StreamReader, headers: Dict[str, str], max_bytes: int) -> bytes:
+    body = bytearray()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while len(body) < max_bytes:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()
+    elif headers.get('content-length', '').isdigit():
+        body += await reader.readexactly(min(int(headers['content-length']), max_bytes))
+    else:
+        while len(body) < max_bytes:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            body += chunk
+    return bytes(body[:max_bytes])
+
+# 异步GET完整内容（跟随重定向），返回 (最终地址, 响应头, 内容, 首字节时间, 总耗时)
+async def async_http_fetch(url: str, timeout: float, ssl_context: ssl.SSLContext, dns_cache: Optional[DnsCache], max_bytes: int) -> Tuple[str, Dict[str, str], bytes, float, float]:
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Connection': 'close'
+    }
+    current_url = url
+    for _ in range(VALIDATION_MAX_REDIRECTS + 1):
+        start_time = time.time()
+        status, response_headers, reader, writer, _ = await async_http_request(current_url, headers, timeout, ssl_context, dns_cache)
+        ttfb = time.time() - start_time
+        try:
+            if status in (301, 302, 303, 307, 308) and response_headers.get('location'):
+                current_url = urljoin(current_url, response_headers['location'])
+                continue
+            if status not in (200, 206):
+                raise ValueError(f"HTTP {status}")
+            body = await read_http_body(reader, response_headers, max_bytes)
+            return current_url, response_headers, body, ttfb, time.time() - start_time
+        finally:
+            await close_writer(writer)
+    raise ValueError("too many redirects")
+
+# 解析 #EXT-X-STREAM-INF 的属性
+def parse_hls_attributes(line: str) -> Dict[str, str]:
+    attributes = {}
+    for match in re.finditer(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(':', 1)[-1]):
+        attributes[match.group(1)] = match.group(2).strip('"')
+    return attributes
+
+# HLS深度探测：主播放列表选择声明码率最高的子流，再下载媒体播放列表的首个分片
+async def deep_probe_hls(url: str, timeout: float = DEEP_PROBE_TIMEOUT, ssl_context: Optional[ssl.SSLContext] = None, dns_cache: Optional[DnsCache] = None) -> Optional[StreamQuality]:
+    ssl_context = ssl_context or create_probe_ssl_context()
+    bandwidth = None
+    resolution = None
+    playlist_url = url
+    for _ in range(2):  # 主播放列表 -> 媒体播放列表
+        playlist_url, _, body, _, _ = await async_http_fetch(playlist_url, timeout, ssl_context, dns_cache, DEEP_PROBE_MAX_PLAYLIST_BYTES)
+        lines = [line.strip() for line in body.decode('utf-8', errors='replace').splitlines() if line.strip()]
+        if not lines or not lines[0].startswith('#EXTM3U'):
+            return None
+
+        variants = []
+        for index, line in enumerate(lines):
+            if line.startswith('#EXT-X-STREAM-INF') and index + 1 < len(lines) and not lines[index + 1].startswith('#'):
+                attributes = parse_hls_attributes(line)
+                declared = int(attributes['BANDWIDTH']) if attributes.get('BANDWIDTH', '').isdigit() else 0
+                variants.append((declared, attributes.get('RESOLUTION'), lines[index + 1]))
+        if not variants:
+            break
+        declared, resolution, variant_uri = max(variants, key=lambda variant: variant[0])
+        bandwidth = declared or None
+        playlist_url = urljoin(playlist_url, variant_uri)
+    else:
+        return None
+
+    segments = [line for line in lines if not line.startswith('#')]
+    if not segments:
+        return None
+    segment_url = urljoin(playlist_url, segments[0])
+    _, _, segment, ttfb, elapsed = await async_http_fetch(segment_url, timeout, ssl_context, dns_cache, DEEP_PROBE_MAX_SEGMENT_BYTES)
+    if not segment:
+        return None
+    return StreamQuality(ttfb, len(segment) / max(elapsed, 1e-3), bandwidth, resolution)
+
+# 多次采样：只对排名在第 MAX_SOURCES_PER_CHANNEL 名附近的候选补充采样，按综合得分排序
+MAX_SOURCES_PER_CHANNEL = 10       # 每个频道最终保留的源数量
+LATENCY_SAMPLES = 1                # 临界频道每个候选的总采样次数（含本次运行的首次验证），1 表示不补充采样
+LATENCY_SAMPLE_MARGIN = 3          # 保留名额之外再多少个候选参与补充采样
+LATENCY_SAMPLE_SPACING = 10        # 相邻两轮采样的最小间隔（秒），让采样分散在运行期间
+LATENCY_SCORE_WEIGHTS = {'p50': 1.0, 'p95': 0.0, 'jitter': 0.5}  # 得分 = 各项加权和，越小越好
+
+class LatencyStats(NamedTuple):
+    p50: float
+    p95: float
+    jitter: float    # 相邻两次采样差值绝对值的平均
+    samples: int
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize_latencies(samples: List[float]) -> LatencyStats:
+    jitter = 0.0
+    if len(samples) > 1:
+        jitter = sum(abs(b - a) for a, b in zip(samples, samples[1:])) / (len(samples) - 1)
+    return LatencyStats(percentile(samples, 0.5), percentile(samples, 0.95), jitter, len(samples))
+
+def latency_score(stats: LatencyStats, weights: Dict[str, float] = LATENCY_SCORE_WEIGHTS) -> float:
+    return sum(weight * getattr(stats, name) for name, weight in weights.items())
+
+# 主机健康状态：同一主机连续 N 次连接失败后，其余地址不再探测直接判为无效
+HOST_FAILURE_THRESHOLD = 3         # 连续连接失败次数阈值
+HOST_RETRY_AT_END = True           # 全部探测结束后，对被短路的主机再试一次
+
+# 主机健康按 主机:端口 统计：同一 IP 的不同端口常常是不同的服务，一个端口不通不代表其他端口也不通
+def health_key(url: str) -> str:
+    parsed = urlparse(url)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    return f"{(parsed.hostname or '').lower()}:{port or DEFAULT_PORTS.get(parsed.scheme, 80)}"
+
+class HostHealthTracker:
+    def __init__(self, threshold: int = HOST_FAILURE_THRESHOLD):
+        self.threshold = max(1, threshold)
+        self.consecutive_failures = Counter()
+        self.failure_seconds = {}  # 主机:端口 -> 连接失败累计耗时，用于估算节省的探测时间
+        self.failure_count = Counter()
+        self.down_hosts = set()
+        self.skipped = {}  # 主机:端口 -> 被短路的地址列表
+
+    def is_down(self, host: str) -> bool:
+        return host in self.down_hosts
+
+    # 只有连接阶段失败（含连接超时）才算主机不通；连接成功后读取超时说明主机在线，不计入
+    def record(self, host: str, result: ProbeResult, elapsed: float) -> None:
+        if result.error == 'connect':
+            self.consecutive_failures[host] += 1
+            self.failure_count[host] += 1
+            self.failure_seconds[host] = self.failure_seconds.get(host, 0.0) + elapsed
+            if self.consecutive_failures[host] >= self.threshold:
+                self.down_hosts.add(host)
+        else:
+            self.consecutive_failures[host] = 0
+
+    def skip(self, host: str, url: str) -> None:
+        self.skipped.setdefault(host, []).append(url)
+
+    def mark_up(self, host: str) -> List[str]:
+        self.down_hosts.discard(host)
+        self.consecutive_failures[host] = 0
+        return self.skipped.pop(host, [])
+
+    def saved_seconds(self, host: str) -> float:
+        if not self.failure_count[host]:
+            return 0.0
+        return len(self.skipped.get(host, [])) * self.failure_seconds[host] / self.failure_count[host]
+
+    def summary(self) -> str:
+        if not self.skipped:
+            return "主机短路: 无"
+        total_skipped = sum(len(urls) for urls in self.skipped.values())
+        total_saved = sum(self.saved_seconds(host) for host in self.skipped)
+        lines = [f"主机短路: {len(self.skipped)} 个主机端口, 跳过 {total_skipped} 次探测, 约节省 {total_saved:.1f} 秒探测时间"]
+        for host in sorted(self.skipped, key=lambda h: -len(self.skipped[h])):
+            lines.append(f"  {host}: 跳过 {len(self.skipped[host])} 个地址, 约 {self.saved_seconds(host):.1f} 秒")
+        return '\n'.join(lines)
+
+# Top-K 提前结束：每个频道按优先级顺序探测，已有 K 个源在延迟阈值内验证通过后，不再探测该频道其余候选
+VALIDATION_TOP_K = 10              # 每个频道需要的合格源数量，0 表示验证全部候选
+VALIDATION_TOP_K_LATENCY = 1.5     # 计入 K 个合格源的延迟上限（秒）
+
+class TopKScheduler:
+    def __init__(self, channel_candidates: Dict[str, List[str]], initial_good: Dict[str, int], top_k: int, latency_threshold: float,
+                 channel_order: Optional[Dict[str, int]] = None, deadline: Optional[float] = None):
+        self.top_k = top_k
+        self.latency_threshold = latency_threshold
+        self.candidates = channel_candidates
+        self.deadline = deadline
+        self.expired = False
+        self.cursor = {channel_name: 0 for channel_name in channel_candidates}
+        self.good = {channel_name: initial_good.get(channel_name, 0) for channel_name in channel_candidates}
+        self.in_flight = {channel_name: 0 for channel_name in channel_candidates}
+        self.abandoned = Counter()  # 频道 -> 时间预算用完时还在排队、没有实际探测的候选数
+        self.total_in_flight = 0
+        self.issued = 0
+        # 频道在字典中的顺序，不在字典中的排在最后
+        channel_order = channel_order or {}
+        self.rank = {channel_name: (channel_order.get(channel_name, len(channel_order)), index)
+                     for index, channel_name in enumerate(channel_candidates)}
+        self.ready = []  # 堆：(优先级, 频道名)，优先级过期时取出后重新放回
+        self.ready_set = set()
+        for channel_name in channel_candidates:
+            self._mark_ready(channel_name)
+
+    # 合格数加上进行中的探测数仍不足 K（K 为 0 表示不限），且还有未探测的候选
+    def _needs_probe(self, channel_name: str) -> bool:
+        return (self.cursor[channel_name] < len(self.candidates[channel_name])
+                and (self.top_k <= 0 or self.good[channel_name] + self.in_flight[channel_name] < self.top_k))
+
+    # 合格源越少的频道越先探测，其次按字典顺序；频道内的候选已按预计成功率排好
+    def _priority(self, channel_name: str) -> Tuple:
+        return (self.good[channel_name] + self.in_flight[channel_name],) + self.rank[channel_name]
+
+    def _mark_ready(self, channel_name: str) -> None:
+        if channel_name not in self.ready_set and self._needs_probe(channel_name):
+            heapq.heappush(self.ready, (self._priority(channel_name), channel_name))
+            self.ready_set.add(channel_name)
+
+    # 取优先级最高的频道的下一个候选，返回 (频道名, 地址)；时间预算用完后不再发出新探测
+    def next_probe(self) -> Optional[Tuple[str, str]]:
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.expired = True
+            return None
+        while self.ready:
+            priority, channel_name = heapq.heappop(self.ready)
+            self.ready_set.discard(channel_name)
+            if not self._needs_probe(channel_name):
+                continue
+            if priority != self._priority(channel_name):
+                self._mark_ready(channel_name)
+                continue
+            url = self.candidates[channel_name][self.cursor[channel_name]]
+            self.cursor[channel_name] += 1
+            self.in_flight[channel_name] += 1
+            self.total_in_flight += 1
+            self.issued += 1
+            self._mark_ready(channel_name)
+            return channel_name, url
+        return None
+
+    def complete(self, channel_name: str, result: ProbeResult) -> None:
+        self.in_flight[channel_name] -= 1
+        self.total_in_flight -= 1
+        if result.error == 'budget':
+            self.expired = True
+            self.abandoned[channel_name] += 1
+        elif result.ok and result.latency is not None and result.latency <= self.latency_threshold:
+            self.good[channel_name] += 1
+        self._mark_ready(channel_name)
+
+    # 时间预算用完时仍缺合格源、还有候选没探测的频道
+    def cut_short(self) -> List[str]:
+        if not self.expired:
+            return []
+        return [channel_name for channel_name in self.candidates
+                if (self.cursor[channel_name] < len(self.candidates[channel_name]) or self.abandoned[channel_name])
+                and (self.top_k <= 0 or self.good[channel_name] < self.top_k)]
+
+    def skipped_count(self) -> int:
+        return sum(len(urls) - self.cursor[channel_name] for channel_name, urls in self.candidates.items())
+
+# 异步验证引擎：固定数量的工作协程从有界队列取地址，内存占用与并发上限成正比
+class AsyncStreamValidator:
+    def __init__(self, timeout: float = VALIDATION_TIMEOUT, concurrency: int = VALIDATION_CONCURRENCY, dns_cache: Optional[DnsCache] = None,
+                 host_health: Optional[HostHealthTracker] = None, retry_down_hosts: bool = HOST_RETRY_AT_END, deep_probe: bool = VALIDATION_DEEP_PROBE,
+                 scheduler: Optional[RequestScheduler] = None):
+        self.timeout = timeout
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.deep_probe = deep_probe
+        self.concurrency = max(1, concurrency)
+        self.ssl_context = create_probe_ssl_context()
+        self.dns_cache = dns_cache if dns_cache is not None else DnsCache()
+        self.host_health = host_health if host_health is not None else HostHealthTracker()
+        self.retry_down_hosts = retry_down_hosts
+        self.cut_short = []  # 时间预算用完时没验证完的频道
+        self.deadline = None  # 过了这个时间，排队中的探测直接放弃（结果为 'budget'，不计入结果）
+
+    async def probe(self, url: str) -> ProbeResult:
+        result = await validate_stream_url_async(url, self.timeout, self.ssl_context, self.dns_cache)
+        if result.ok and self.deep_probe and '.m3u8' in urlparse(url).path.lower():
+            try:
+                quality = await asyncio.wait_for(deep_probe_hls(url, DEEP_PROBE_TIMEOUT, self.ssl_context, self.dns_cache), timeout=DEEP_PROBE_TIMEOUT)
+            except Exception:
+                quality = None
+            # 播放列表可以访问但拿不到分片的源无法播放，判为无效
+            if quality is None:
+                return ProbeResult(False, None, 'hls')
+            result = result._replace(quality=quality)
+        return result
+
+    async def _probe_scheduled(self, url: str) -> ProbeResult:
+        host = (urlparse(url).hostname or '').lower()
+        await self.scheduler.acquire_async(host, 'probe')
+        try:
+            return await self.probe(url)
+        finally:
+            self.scheduler.release(host)
+
+    # 探测单个地址；所在主机端口已判定为不可用时直接返回无效
+    async def _check(self, url: str) -> ProbeResult:
+        host = (urlparse(url).hostname or '').lower()
+        key = health_key(url)
+        if self.host_health.is_down(key):
+            self.host_health.skip(key, url)
+            return ProbeResult(False, None, 'host-down')
+        await self.scheduler.acquire_async(host, 'probe')
+        try:
+            # 排队期间主机端口可能已被判定为不可用，或者时间预算已经用完
+            if self.host_health.is_down(key):
+                self.host_health.skip(key, url)
+                return ProbeResult(False, None, 'host-down')
+            if self.deadline is not None and time.time() >= self.deadline:
+                return ProbeResult(False, None, 'budget')
+            start_time = time.time()
+            result = await self.probe(url)
+        finally:
+            self.scheduler.release(host)
+        self.host_health.record(key, result, time.time() - start_time)
+        return result
+
+    async def _worker(self, queue: asyncio.Queue, results: Dict[str, ProbeResult]) -> None:
+        while True:
+            url = await queue.get()
+            try:
+                if url is None:
+                    return
+                results[url] = await self._check(url)
+            finally:
+                queue.task_done()
+
+    async def _run_queue(self, urls: List[str], results: Dict[str, ProbeResult]) -> None:
+        worker_count = min(self.concurrency, len(urls))
+        if worker_count == 0:
+            return
+
+        queue = asyncio.Queue(maxsize=worker_count * 2)
+        workers = [asyncio.ensure_future(self._worker(queue, results)) for _ in range(worker_count)]
+        for url in urls:
+            await queue.put(url)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    # 对被短路的每个 主机:端口 各重试一个被跳过的地址，成功则恢复并探测其余被跳过的地址
+    async def _retry_down_hosts(self, results: Dict[str, ProbeResult]) -> None:
+        keys = sorted(self.host_health.skipped)
+        if not keys:
+            return
+        retry_results = await asyncio.gather(*(self._probe_scheduled(self.host_health.skipped[key][0]) for key in keys))
+        recovered_urls = []
+        for key, result in zip(keys, retry_results):
+            if result.ok:
+                skipped_urls = self.host_health.mark_up(key)
+                results[skipped_urls[0]] = result
+                recovered_urls.extend(skipped_urls[1:])
+                print(f"主机恢复: {key}, 重新探测 {len(skipped_urls) - 1} 个地址")
+        await self._run_queue(recovered_urls, results)
+
+    async def _scheduled_worker(self, scheduler: TopKScheduler, condition: asyncio.Condition, results: Dict[str, ProbeResult]) -> None:
+        while True:
+            async with condition:
+                while True:
+                    item = scheduler.next_probe()
+                    if item is not None:
+                        break
+                    if scheduler.total_in_flight == 0:
+                        condition.notify_all()
+                        return
+                    await condition.wait()
+            channel_name, url = item
+            try:
+                result = await self._check(url)
+            except Exception:
+                result = ProbeResult(False, None, 'error')
+            if result.error != 'budget':
+                results[url] = result
+            async with condition:
+                scheduler.complete(channel_name, result)
+                condition.notify_all()
+
+    async def validate_channels_async(self, channel_candidates: Dict[str, List[str]], initial_good: Dict[str, int],
+                                      top_k: int, latency_threshold: float, channel_order: Optional[Dict[str, int]] = None,
+                                      deadline: Optional[float] = None) -> Dict[str, ProbeResult]:
+        results = {}
+        self.deadline = deadline
+        scheduler = TopKScheduler(channel_candidates, initial_good, top_k, latency_threshold, channel_order, deadline)
+        total_candidates = sum(len(urls) for urls in channel_candidates.values())
+        worker_count = min(self.concurrency, total_candidates)
+        if worker_count > 0:
+            condition = asyncio.Condition()
+            await asyncio.gather(*(self._scheduled_worker(scheduler, condition, results) for _ in range(worker_count)))
+        print(f"Top-{top_k} 提前结束: 候选 {total_candidates} 个, 实际探测 {scheduler.issued} 次, 跳过 {scheduler.skipped_count()} 个")
+        self.cut_short = scheduler.cut_short()
+        if scheduler.expired:
+            print(f"时间预算用完: {len(self.cut_short)} 个频道未验证完")
+        elif self.retry_down_hosts:
+            await self._retry_down_hosts(results)
+        return results
+
+    async def validate_async(self, urls: List[str]) -> Dict[str, ProbeResult]:
+        results = {}
+        await self._run_queue(list(dict.fromkeys(urls)), results)
+        if self.retry_down_hosts:
+            await self._retry_down_hosts(results)
+        return results
+
+    # 补充采样：每轮之间至少间隔 spacing 秒，失败的采样按超时时间计入
+    async def sample_latencies_async(self, urls: List[str], rounds: int, spacing: float,
+                                     since: Optional[float] = None) -> Dict[str, List[float]]:
+        samples = {url: [] for url in urls}
+        previous_round = since if since is not None else time.time()
+        for _ in range(rounds):
+            wait = spacing - (time.time() - previous_round)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            previous_round = time.time()
+            round_results = {}
+            await self._run_queue(urls, round_results)
+            for url in urls:
+                result = round_results.get(url)
+                samples[url].append(result.latency if result is not None and result.ok and result.latency is not None else self.timeout)
+        return samples
+
+    def sample_latencies(self, urls: List[str], rounds: int, spacing: float = LATENCY_SAMPLE_SPACING,
+                         since: Optional[float] = None) -> Dict[str, List[float]]:
+        if not urls or rounds <= 0:
+            return {}
+        start_time = time.time()
+        samples = asyncio.run(self.sample_latencies_async(urls, rounds, spacing, since))
+        print(f"补充采样: {len(urls)} 个临界候选 x {rounds} 轮, 耗时 {time.time() - start_time:.2f} 秒")
+        return samples
+
+    # 同步入口，返回完整的探测结果；给出 channel_candidates 时按频道做 Top-K 提前结束
+    def validate_detailed(self, urls: List[str], channel_candidates: Optional[Dict[str, List[str]]] = None,
+                          initial_good: Optional[Dict[str, int]] = None, top_k: int = VALIDATION_TOP_K,
+                          latency_threshold: float = VALIDATION_TOP_K_LATENCY, channel_order: Optional[Dict[str, int]] = None,
+                          deadline: Optional[float] = None) -> Dict[str, ProbeResult]:
+        start_time = time.time()
+        self.dns_cache.prefetch(urlparse(url).hostname for url in urls)
+        if channel_candidates is not None and (top_k > 0 or deadline is not None):
+            results = asyncio.run(self.validate_channels_async(channel_candidates, initial_good or {}, top_k, latency_threshold,
+                                                               channel_order, deadline))
+        else:
+            results = asyncio.run(self.validate_async(urls))
+        valid_count = sum(1 for result in results.values() if result.ok)
+        print(f"异步验证完成: {len(results)} 个地址, 有效 {valid_count} 个, 耗时 {time.time() - start_time:.2f} 秒")
+        timed = [result.timings for result in results.values() if result.ok and result.timings is not None]
+        if timed:
+            print(f"探测阶段平均耗时: 连接 {sum(t.connect for t in timed) / len(timed) * 1000:.0f} ms, "
+                  f"TLS {sum(t.tls for t in timed) / len(timed) * 1000:.0f} ms, 首字节 {sum(t.ttfb for t in timed) / len(timed) * 1000:.0f} ms")
+        if self.deep_probe:
+            deep_count = sum(1 for result in results.values() if result.quality is not None)
+            print(f"HLS深度探测: {deep_count} 个地址取得分片下载速率")
+        print(self.dns_cache.summary())
+        print(self.host_health.summary())
+        print(self.scheduler.summary())
+        return results
+
+    # 同步入口，返回与 validate_stream_url 相同的 (是否有效, 响应时间) 结构
+    def validate(self, urls: List[str]) -> Dict[str, Tuple[bool, Optional[float]]]:
+        return {url: (result.ok, result.latency) for url, result in self.validate_detailed(urls).items()}
+
+# 验证结果持久化：按规范化地址保存上次探测结果，未过期的结果直接复用
+VALIDATION_STORE_FILE = os.path.join(CACHE_DIR, 'validation.sqlite3')
+VALIDATION_POSITIVE_TTL = 30 * 3600   # 有效结果的最长复用时间（秒），按地址分散到 15~30 小时：每天运行一次时约 4 成有效结果在第二天复用，任何结果最多复用一次
+VALIDATION_NEGATIVE_TTL = 24 * 3600   # 无效结果的复用时间（秒），随连续失败次数增加
+SCORE_EWMA_ALPHA = 0.3                # 历史得分中最新一次运行结果的权重
+SCORE_PRIOR_SUCCESS = 0.5             # 地址和主机都没有历史时的预计成功率
+UNKNOWN_PRIORITY = (1 - SCORE_PRIOR_SUCCESS, VALIDATION_TIMEOUT)  # 没有历史得分的候选的 (失败概率, 延迟)
+
+class ValidationStore:
+    def __init__(self, path: str = VALIDATION_STORE_FILE, positive_ttl: float = VALIDATION_POSITIVE_TTL, negative_ttl: float = VALIDATION_NEGATIVE_TTL):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.reused = 0
+        self.probed = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 解析线程和主线程共用一个连接，所有读写都在 self.lock 内进行
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "url TEXT PRIMARY KEY, ok INTEGER NOT NULL, latency REAL, "
+            "probed_at REAL NOT NULL, failures INTEGER NOT NULL DEFAULT 0)"
+        )
+        # HLS深度探测指标（旧数据库自动补列）
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(probes)")}
+        for column, column_type in (('ttfb', 'REAL'), ('throughput', 'REAL'), ('bandwidth', 'INTEGER'), ('resolution', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE probes ADD COLUMN {column} {column_type}")
+        # 跨运行的指数加权得分：成功率和有效时的平均延迟，按地址和按主机各一份
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_scores ("
+            "url TEXT PRIMARY KEY, channel TEXT, host TEXT, success REAL NOT NULL, latency REAL, "
+            "runs INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS host_scores ("
+            "host TEXT PRIMARY KEY, success REAL NOT NULL, latency REAL, runs INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    # 按地址哈希把有效期分散到 50%~100%，避免同一批结果在同一天集中过期
+    @staticmethod
+    def _spread(url: str) -> float:
+        return 0.5 + int(hashlib.md5(url.encode('utf-8')).hexdigest()[:4], 16) / 0xFFFF / 2
+
+    def _is_fresh(self, url: str, ok: bool, probed_at: float, failures: int, now: float) -> bool:
+        if ok:
+            ttl = self.positive_ttl
+        else:
+            ttl = self.negative_ttl * min(max(failures, 1), 4)
+        return now - probed_at < ttl * self._spread(url)
+
+    # 返回未过期的结果：规范化地址 -> 探测结果
+    def lookup_fresh(self, canonical_urls: Iterable[str]) -> Dict[str, ProbeResult]:
+        now = time.time()
+        fresh = {}
+        rows = self._select_batched(
+            "SELECT url, ok, latency, probed_at, failures, ttfb, throughput, bandwidth, resolution FROM probes WHERE url IN ({})",
+            list(canonical_urls)
+        )
+        for url, ok, latency, probed_at, failures, ttfb, throughput, bandwidth, resolution in rows:
+            if self._is_fresh(url, bool(ok), probed_at, failures, now):
+                quality = StreamQuality(ttfb, throughput, bandwidth, resolution) if throughput is not None else None
+                fresh[url] = ProbeResult(bool(ok), latency, '' if ok else 'cached', quality)
+        with self.lock:
+            self.reused += len(fresh)
+        return fresh
+
+    def _select_batched(self, query: str, keys: List[str]) -> List[Tuple]:
+        rows = []
+        with self.lock:
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                rows.extend(self.conn.execute(query.format(','.join('?' * len(batch))), batch).fetchall())
+        return rows
+
+    # 预计的 (失败概率, 延迟)，越小越好：有地址历史用地址得分，否则用所在主机的得分
+    def predicted_priorities(self, canonical_urls: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+        canonical_urls = list(canonical_urls)
+        url_scores = {url: (success, latency) for url, success, latency in
+                      self._select_batched("SELECT url, success, latency FROM url_scores WHERE url IN ({})", canonical_urls)}
+        host_by_url = {url: (urlparse(url).hostname or '').lower() for url in canonical_urls if url not in url_scores}
+        host_scores = {host: (success, latency) for host, success, latency in
+                       self._select_batched("SELECT host, success, latency FROM host_scores WHERE host IN ({})", sorted(set(host_by_url.values())))}
+        priorities = {}
+        for url in canonical_urls:
+            score = url_scores.get(url) or host_scores.get(host_by_url.get(url))
+            if score is not None:
+                success, latency = score
+                priorities[url] = (1 - success, latency if latency is not None else VALIDATION_TIMEOUT)
+        return priorities
+
+    # 用本次运行的探测结果更新得分；主机按本次运行的平均成功率更新一次，不受地址数量影响
+    def update_scores(self, results: Dict[str, ProbeResult], channels: Dict[str, str], alpha: float = SCORE_EWMA_ALPHA) -> None:
+        now = time.time()
+        urls = list(results)
+        previous = {url: (success, latency, runs) for url, success, latency, runs in
+                    self._select_batched("SELECT url, success, latency, runs FROM url_scores WHERE url IN ({})", urls)}
+        url_rows = []
+        host_runs = {}
+        for url, result in results.items():
+            host = (urlparse(url).hostname or '').lower()
+            success, latency = self._ewma(previous.get(url), result.ok, result.latency, alpha)
+            runs = previous[url][2] + 1 if url in previous else 1
+            url_rows.append((url, channels.get(url), host, success, latency, runs, now))
+            host_runs.setdefault(host, []).append(result)
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO url_scores (url, channel, host, success, latency, runs, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                url_rows
+            )
+
+        hosts = sorted(host_runs)
+        previous_hosts = {host: (success, latency, runs) for host, success, latency, runs in
+                          self._select_batched("SELECT host, success, latency, runs FROM host_scores WHERE host IN ({})", hosts)}
+        host_rows = []
+        for host in hosts:
+            host_results = host_runs[host]
+            latencies = [result.latency for result in host_results if result.ok and result.latency is not None]
+            run_success = sum(1 for result in host_results if result.ok) / len(host_results)
+            run_latency = sum(latencies) / len(latencies) if latencies else None
+            success, latency = self._ewma(previous_hosts.get(host), run_success, run_latency, alpha)
+            runs = previous_hosts[host][2] + 1 if host in previous_hosts else 1
+            host_rows.append((host, success, latency, runs, now))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO host_scores (host, success, latency, runs, updated_at) VALUES (?, ?, ?, ?, ?)",
+                host_rows
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def _ewma(previous: Optional[Tuple], success: float, latency: Optional[float], alpha: float) -> Tuple[float, Optional[float]]:
+        if previous is None:
+            return float(success), latency
+        previous_success, previous_latency = previous[0], previous[1]
+        new_success = alpha * float(success) + (1 - alpha) * previous_success
+        if latency is None:
+            return new_success, previous_latency
+        if previous_latency is None:
+            return new_success, latency
+        return new_success, alpha * latency + (1 - alpha) * previous_latency
+
+    # 连续失败次数：规范化地址 -> 次数
+    def failure_counts(self, canonical_urls: List[str]) -> Dict[str, int]:
+        return dict(self._select_batched("SELECT url, failures FROM probes WHERE url IN ({})", canonical_urls))
+
+    # 某个频道所有地址的历史得分，按预计成功率从高到低
+    def channel_scores(self, channel_name: str) -> List[Tuple[str, float, Optional[float], int, Optional[float]]]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT url_scores.url, url_scores.success, url_scores.latency, url_scores.runs, host_scores.success "
+                "FROM url_scores LEFT JOIN host_scores ON host_scores.host = url_scores.host "
+                "WHERE url_scores.channel = ? ORDER BY url_scores.success DESC, url_scores.latency", (channel_name,)
+            ).fetchall()
+
+    def record_many(self, results: Dict[str, ProbeResult]) -> None:
+        now = time.time()
+        self.probed += len(results)
+        rows = []
+        for url, result in results.items():
+            quality = result.quality or StreamQuality(None, None)
+            rows.append((url, int(result.ok), result.latency, now, 0 if result.ok else 1,
+                         quality.ttfb, quality.throughput, quality.bandwidth, quality.resolution))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO probes (url, ok, latency, probed_at, failures, ttfb, throughput, bandwidth, resolution) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET ok = excluded.ok, latency = excluded.latency, probed_at = excluded.probed_at, "
+                "failures = CASE WHEN excluded.ok THEN 0 ELSE probes.failures + 1 END, "
+                "ttfb = excluded.ttfb, throughput = excluded.throughput, bandwidth = excluded.bandwidth, resolution = excluded.resolution",
+                rows
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def summary(self) -> str:
+        return f"验证结果缓存: 复用 {self.reused} 条, 实际探测 {self.probed} 条"
+
+# 失效地址过滤器：连续多次运行都探测失败的地址记入布隆过滤器，下次解析时直接跳过，不再花一次超时去探测
+# 分新旧两代，每隔一段时间轮换一次，旧的一代被丢弃，这样恢复的地址最多两个周期后会被重新探测
+DEAD_URL_FILTER_FILE = os.path.join(CACHE_DIR, 'dead_urls.bloom')
+DEAD_URL_RUNS = 3                      # 连续失败多少次运行后记入过滤器
+DEAD_URL_FILTER_BITS = 1 << 21         # 每一代的位数（256KB），约 15 万个地址时误判率 1%
+DEAD_URL_FILTER_HASHES = 7
+DEAD_URL_FILTER_ROTATE = 7 * 24 * 3600 # 轮换周期（秒）
+
+class DeadUrlFilter:
+    HEADER = struct.Struct('<4sIIdd')  # 标识, 位数, 哈希个数, 当前一代的创建时间, 上一代的创建时间
+    MAGIC = b'DUF1'
+
+    def __init__(self, path: str = DEAD_URL_FILTER_FILE, bits: int = DEAD_URL_FILTER_BITS, hashes: int = DEAD_URL_FILTER_HASHES,
+                 rotate_after: float = DEAD_URL_FILTER_ROTATE):
+        self.path = path
+        self.bits = bits
+        self.hashes = hashes
+        self.rotate_after = rotate_after
+        self.current = bytearray(bits // 8)
+        self.previous = bytearray(bits // 8)
+        self.current_created = time.time()
+        self.previous_created = self.current_created
+        self.added = 0
+        self.load()
+        self.rotate()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            magic, bits, hashes, current_created, previous_created = self.HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return
+        size = bits // 8
+        # 参数变了或文件不完整时丢弃旧数据，重新积累
+        if magic != self.MAGIC or bits != self.bits or hashes != self.hashes or len(data) != self.HEADER.size + 2 * size:
+            return
+        offset = self.HEADER.size
+        self.current = bytearray(data[offset:offset + size])
+        self.previous = bytearray(data[offset + size:])
+        self.current_created = current_created
+        self.previous_created = previous_created
+
+    def save(self) -> None:
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_file = self.path + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.bits, self.hashes, self.current_created, self.previous_created))
+                f.write(self.current)
+                f.write(self.previous)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            print(f"保存失效地址过滤器失败: {e}")
+
+    # 当前一代满一个周期后变成上一代，原来的上一代丢弃
+    def rotate(self) -> None:
+        now = time.time()
+        if now - self.current_created < self.rotate_after:
+            return
+        if now - self.current_created >= 2 * self.rotate_after:
+            self.previous = bytearray(self.bits // 8)
+        else:
+            self.previous = self.current
+        self.previous_created = self.current_created
+        self.current = bytearray(self.bits // 8)
+        self.current_created = now
+
+    def _positions(self, canonical_url: str) -> List[int]:
+        digest = hashlib.blake2b(canonical_url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, canonical_url: str) -> None:
+        for position in self._positions(canonical_url):
+            self.current[position >> 3] |= 1 << (position & 7)
+        self.added += 1
+
+    def __contains__(self, canonical_url: str) -> bool:
+        positions = self._positions(canonical_url)
+        for generation in (self.current, self.previous):
+            if all(generation[position >> 3] & (1 << (position & 7)) for position in positions):
+                return True
+        return False
+
+    def summary(self) -> str:
+        return f"失效地址过滤器: 本次新记入 {self.added} 个地址"
+
+# 易变查询参数（时间戳、有效期、签名等），只用于去重，不影响输出的地址
+# '*' 为默认规则；单独列出的主机使用自己的规则，不与默认规则合并（集合为空表示该主机不去掉任何参数）
+# t、key 在多数主机上是频道标识或固定值，只对确实每次变化的主机去掉
+VOLATILE_QUERY_PARAMS = {
+    '*': {'ttl', 'timestamp'},
+    'stream.sun0769.com': {'t', 'ttl', 'key'}
+}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'rtmp': 1935, 'rtsp': 554}
+
+# 地址规范化：小写协议和主机、去掉默认端口和末尾斜杠、去掉易变参数并对参数排序
+def canonicalize_url(url: str, volatile_params: Dict[str, Set[str]] = VOLATILE_QUERY_PARAMS) -> str:
+    try:
+        parsed = urlparse(url.strip())
+        host = (parsed.hostname or '').lower()
+        port = parsed.port
+    except ValueError:
+        return url
+    if not host:
+        return url
+
+    scheme = parsed.scheme.lower()
+    netloc = host if ':' not in host else f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parsed.username or parsed.password:
+        netloc = f"{parsed.netloc.rsplit('@', 1)[0]}@{netloc}"
+
+    path = parsed.path.rstrip('/')
+    volatile = volatile_params.get(host, volatile_params.get('*', set()))
+    query = sorted((name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True) if name not in volatile)
+
+    canonical = f"{scheme}://{netloc}{path}"
+    if parsed.params:
+        canonical += f";{parsed.params}"
+    if query:
+        canonical += '?' + urlencode(query)
+    return canonical
+
+# 黑名单索引：按 主机 -> 规则列表 组织，规则可限定协议、端口和路径前缀
+# "fm1077.serv00.net"             任意协议、任意端口
+# "http://php.jdshipin.com"        仅 http，任意端口、任意路径
+# "http://112.27.235.94:8000"      仅 http 且端口为 8000
+# "http://host/s/81a8a44f/"        仅 http 且路径以 /s/81a8a44f/ 开头
+class BlacklistIndex:
+    def __init__(self, entries: Iterable[str] = ()):
+        self.rules_by_host = {}
+        self.exact_urls = set()
+        self.rule_count = 0
+        self.rejections = Counter()
+        self.lock = threading.Lock()  # 只保护拦截计数，规则在构造后不再修改
+        for entry in entries:
+            self.add_rule(entry)
+
+    def add_rule(self, entry: str) -> None:
+        entry = entry.strip()
+        if not entry:
+            return
+        try:
+            parsed = urlparse(entry if "://" in entry else f"//{entry}")
+            host = parsed.hostname
+            port = parsed.port
+        except ValueError:
+            host = None
+        if not host:
+            self.exact_urls.add(entry)
+            self.rule_count += 1
+            return
+
+        scheme = parsed.scheme.lower() or None
+        path = parsed.path if parsed.path not in ('', '/') else ''
+        rules = self.rules_by_host.setdefault(host.lower(), [])
+        rule = (scheme, port, path, entry)
+        if rule[:3] not in [existing[:3] for existing in rules]:
+            rules.append(rule)
+            self.rule_count += 1
+
+    # 返回命中的规则原文，未命中返回 None
+    def match(self, url: str) -> Optional[str]:
+        if url in self.exact_urls:
+            with self.lock:
+                self.rejections[url] += 1
+            return url
+        try:
+            parsed = urlparse(url)
+            host = parsed.hostname
+            port = parsed.port
+        except ValueError:
+            return None
+        if not host:
+            return None
+
+        rules = self.rules_by_host.get(host.lower())
+        if not rules:
+            return None
+        scheme = parsed.scheme.lower()
+        for rule_scheme, rule_port, rule_path, entry in rules:
+            if rule_scheme is not None and rule_scheme != scheme:
+                continue
+            if rule_port is not None and rule_port != port:
+                continue
+            if rule_path and not parsed.path.startswith(rule_path):
+                continue
+            with self.lock:
+                self.rejections[entry] += 1
+            return entry
+        return None
+
+    def __contains__(self, url: str) -> bool:
+        return self.match(url) is not None
+
+    def __len__(self) -> int:
+        return self.rule_count
+
+    def summary(self) -> str:
+        total = sum(self.rejections.values())
+        lines = [f"黑名单拦截: {total} 条源, 命中 {len(self.rejections)}/{self.rule_count} 条规则"]
+        for entry, count in self.rejections.most_common():
+            lines.append(f"  {entry}: {count}")
+        return '\n'.join(lines)
+
+# 验证时间预算（秒）：用完后不再发出新探测，用已有结果排序输出；None 表示不限
+VALIDATION_TIME_BUDGET = None
+
+# 流水线验证：解析出的新地址立即进入有界队列，由后台事件循环中的工作协程边下载边验证
+VALIDATION_PIPELINE = True         # False 时仍按 下载 -> 解析 -> 验证 分阶段执行
+PIPELINE_QUEUE_SIZE = 2000         # 等待验证的地址数上限，队列满时解析等待（背压）
+PIPELINE_BATCH_SIZE = 200          # 每攒够多少个地址批量入队一次
+
+class ValidationPipeline:
+    def __init__(self, validator: AsyncStreamValidator, validation_store: Optional[ValidationStore] = None,
+                 volatile_params: Dict[str, Set[str]] = VOLATILE_QUERY_PARAMS, top_k: int = VALIDATION_TOP_K,
+                 latency_threshold: float = VALIDATION_TOP_K_LATENCY, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 channel_order: Optional[Dict[str, int]] = None, time_budget: Optional[float] = VALIDATION_TIME_BUDGET,
+                 is_retained: Optional[Callable[[str, str], bool]] = None):
+        self.validator = validator
+        self.is_retained = is_retained  # (频道名, 地址) 是否仍是保留的候选，探测前检查
+        self.validation_store = validation_store
+        self.volatile_params = volatile_params
+        self.top_k = top_k
+        self.latency_threshold = latency_threshold
+        self.queue_size = max(1, queue_size)
+        self.known_results = {}   # 复用的未过期历史结果
+        self.results = {}         # 本次探测的结果
+        self.good_urls = {}       # 频道 -> 合格且仍保留的地址
+        self.pending = set()      # 已提交、还没有探测结果的 (频道名, 地址)
+        self.extra_tasks = set()  # 合格源被移走后接着探测待定候选的任务
+        self.probing = {}         # 地址 -> 正在进行的探测
+        self.in_flight = Counter()  # 频道 -> 进行中的探测数
+        self.deferred = {}        # 频道 -> 名额已满或时间预算用完时没有探测的候选
+        self.enqueued = Counter() # 频道 -> 已入队的候选数
+        self.channel_order = channel_order or {}
+        self.lock = threading.Lock()  # 多个解析线程同时提交时保护缓冲区和计数
+        self.buffer = []
+        self.queued = 0
+        self.seq = 0
+        self.expired = False
+        self.cut_short = []
+        self.blocked_seconds = 0.0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.started_at = time.time()
+        self.deadline = self.started_at + time_budget if time_budget else None
+        self.validator.deadline = self.deadline
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self) -> None:
+        self.queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self.workers = [asyncio.ensure_future(self._worker()) for _ in range(self.validator.concurrency)]
+
+    def _is_good(self, result: ProbeResult) -> bool:
+        return result.ok and result.latency is not None and result.latency <= self.latency_threshold
+
+    def _good_count(self, channel_name: str) -> int:
+        return len(self.good_urls.get(channel_name, ()))
+
+    def _needs_probe(self, channel_name: str) -> bool:
+        return self.top_k <= 0 or self._good_count(channel_name) + self.in_flight[channel_name] < self.top_k
+
+    def _retained(self, channel_name: str, url: str) -> bool:
+        return self.is_retained is None or self.is_retained(channel_name, url)
+
+    def _count_good(self, channel_name: str, url: str, result: ProbeResult) -> None:
+        if self._is_good(result) and self._retained(channel_name, url):
+            self.good_urls.setdefault(channel_name, set()).add(url)
+
+    # 探测失败或合格源被移走空出名额时，接着探测该频道待定的候选
+    def _next_deferred(self, channel_name: str) -> Optional[str]:
+        deferred = self.deferred.get(channel_name)
+        return deferred.popleft() if deferred and self._needs_probe(channel_name) and not self.expired else None
+
+    # 处理一个候选，返回接着要探测的同频道待定候选
+    async def _process(self, channel_name: str, url: str) -> Optional[str]:
+        # 入队后被淘汰或被其他频道取走的候选不再探测
+        if not self._retained(channel_name, url):
+            with self.lock:
+                self.pending.discard((channel_name, url))
+            return self._next_deferred(channel_name)
+        # 合格数加上进行中的探测数已达 K 或时间预算已用完，先放到该频道的待定列表
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.expired = True
+        if self.expired or not self._needs_probe(channel_name):
+            self.deferred.setdefault(channel_name, deque()).append(url)
+            return None
+        self.in_flight[channel_name] += 1
+        result = await self._probe_once(url)
+        self.in_flight[channel_name] -= 1
+        if result.error == 'budget':
+            self.expired = True
+            self.deferred.setdefault(channel_name, deque()).append(url)
+            return None
+        self.results[url] = result
+        with self.lock:
+            self.pending.discard((channel_name, url))
+        self._count_good(channel_name, url, result)
+        return self._next_deferred(channel_name)
+
+    # 同一地址只探测一次：已有结果直接用，正在探测的（移到其他频道后再次提交）等待同一次探测
+    async def _probe_once(self, url: str) -> ProbeResult:
+        result = self.results.get(url)
+        if result is not None:
+            return result
+        future = self.probing.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.probing[url] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self.validator._check(url)
+        except Exception:
+            result = ProbeResult(False, None, 'error')
+        del self.probing[url]
+        future.set_result(result)
+        return result
+
+    async def _run_channel(self, channel_name: str, url: Optional[str]) -> None:
+        while url is not None:
+            url = await self._process(channel_name, url)
+
+    async def _worker(self) -> None:
+        while True:
+            *_, item = await self.queue.get()
+            if item is None:
+                return
+            await self._run_channel(*item)
+
+    # 在事件循环线程中执行：移走的地址不再计入合格数，空出的名额交给待定的候选
+    def _withdraw(self, channel_name: str, url: str) -> None:
+        good_urls = self.good_urls.get(channel_name)
+        if good_urls is None or url not in good_urls:
+            return
+        good_urls.discard(url)
+        next_url = self._next_deferred(channel_name)
+        if next_url is not None:
+            task = asyncio.ensure_future(self._run_channel(channel_name, next_url))
+            self.extra_tasks.add(task)
+            task.add_done_callback(self.extra_tasks.discard)
+
+    # 候选被淘汰或被其他频道取走时由解析线程调用
+    def withdraw(self, channel_name: str, url: str) -> None:
+        self.loop.call_soon_threadsafe(self._withdraw, channel_name, url)
+
+    # 队列按 (频道已有合格数 + 已入队数, 字典顺序) 排序：缺源的频道和字典靠前的频道先探测
+    # 计数都在事件循环线程里修改，历史结果中合格的频道也在这里计入
+    async def _put_many(self, items: List[Tuple[str, str]], known: List[Tuple[str, str, ProbeResult]]) -> None:
+        for channel_name, url, result in known:
+            self._count_good(channel_name, url, result)
+        for channel_name, url in items:
+            level = self._good_count(channel_name) + self.enqueued[channel_name]
+            self.enqueued[channel_name] += 1
+            self.seq += 1
+            await self.queue.put((level, self.channel_order.get(channel_name, len(self.channel_order)), self.seq, (channel_name, url)))
+
+    # 提交一个保留的候选；已经在排队或待定的地址不重复提交
+    def submit(self, channel_name: str, url: str, priority: Tuple[float, float] = UNKNOWN_PRIORITY) -> None:
+        with self.lock:
+            if (channel_name, url) in self.pending:
+                return
+            self.pending.add((channel_name, url))
+            self.buffer.append((channel_name, url, priority))
+            full = len(self.buffer) >= PIPELINE_BATCH_SIZE
+        if full:
+            self.flush()
+
+    # 先复用本次已有的探测结果和未过期的历史结果，其余地址入队；队列满时在这里等待
+    def flush(self) -> None:
+        with self.lock:
+            items, self.buffer = self.buffer, []
+        if not items:
+            return
+        fresh_results = {}
+        canonical_by_url = {}
+        if self.validation_store is not None:
+            canonical_by_url = {url: canonicalize_url(url, self.volatile_params) for _, url, _ in items}
+            fresh_results = self.validation_store.lookup_fresh(set(canonical_by_url.values()))
+        known = []
+        pending = []
+        for channel_name, url, priority in items:
+            # 被淘汰后又补位的地址可能已经探测过
+            result = self.results.get(url)
+            if result is None:
+                result = fresh_results.get(canonical_by_url.get(url))
+                if result is not None:
+                    self.known_results[url] = result
+            if result is None:
+                pending.append((channel_name, url, priority))
+                continue
+            with self.lock:
+                self.pending.discard((channel_name, url))
+            known.append((channel_name, url, result))
+        items = pending
+        if not items and not known:
+            return
+        self.validator.dns_cache.prefetch(urlparse(url).hostname for _, url, _ in items)
+        # 同一批内按历史得分预计的成功率排序，同一频道里更可能有效的候选先入队
+        items.sort(key=lambda item: item[2])
+        start_time = time.time()
+        asyncio.run_coroutine_threadsafe(self._put_many([(channel_name, url) for channel_name, url, _ in items], known), self.loop).result()
+        with self.lock:
+            self.blocked_seconds += time.time() - start_time
+            self.queued += len(items)
+
+    async def _drain(self) -> None:
+        for _ in self.workers:
+            self.seq += 1
+            await self.queue.put((float('inf'), 0, self.seq, None))
+        await asyncio.gather(*self.workers)
+        while self.extra_tasks:
+            await asyncio.gather(*list(self.extra_tasks))
+        if self.validator.retry_down_hosts and not self.expired:
+            await self.validator._retry_down_hosts(self.results)
+
+    # 等待队列清空并停止事件循环，返回 (复用的历史结果, 本次探测结果)
+    def finish(self) -> Tuple[Dict[str, ProbeResult], Dict[str, ProbeResult]]:
+        self.flush()
+        asyncio.run_coroutine_threadsafe(self._drain(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        valid_count = sum(1 for result in self.results.values() if result.ok)
+        skipped = sum(len(urls) for urls in self.deferred.values())
+        if self.expired:
+            self.cut_short = [channel_name for channel_name, urls in self.deferred.items()
+                              if urls and (self.top_k <= 0 or self._good_count(channel_name) < self.top_k)]
+            print(f"时间预算用完: {len(self.cut_short)} 个频道未验证完")
+        print(f"流水线验证完成: 入队 {self.queued} 个, 复用历史结果 {len(self.known_results)} 个, 探测 {len(self.results)} 个, "
+              f"有效 {valid_count} 个, Top-{self.top_k} 跳过 {skipped} 个, 入队等待 {self.blocked_seconds:.2f} 秒, "
+              f"总耗时 {time.time() - self.started_at:.2f} 秒")
+        print(self.validator.dns_cache.summary())
+        print(self.validator.host_health.summary())
+        print(self.validator.scheduler.summary())
+        return self.known_results, self.results
+
+# 每个频道的候选集合：精选源单独保存，待验证的候选放在容量有限的堆里，满了以后淘汰优先级最低的
+MAX_CANDIDATES_PER_CHANNEL = 100   # 每个频道最多保留的待验证候选数，0 表示不限；另外最多保留同样数量的备选，内存上限为 频道数 x 2 x 上限
+
+class ChannelCandidates:
+    __slots__ = ('cap', 'pinned', 'heap', 'kept', 'spare', 'overflow')
+
+    def __init__(self, cap: int = MAX_CANDIDATES_PER_CHANNEL):
+        self.cap = cap
+        self.pinned = {}   # me.txt 精选源 地址 -> 加入顺序，不参与淘汰
+        self.heap = []     # (-失败概率, -延迟, -加入顺序, 地址)，堆顶是优先级最低的候选
+        self.kept = {}     # 地址 -> heap 中的条目
+        self.spare = []    # 被淘汰的候选中优先级最高的至多 cap 个 (失败概率, 延迟, 加入顺序, 地址)，从好到差排列，保留的候选被移走时用来补位
+        self.overflow = 0  # 连备选也没保留下来、也没有被其他频道取走的候选数
+
+    def add_pinned(self, url: str, order: int) -> None:
+        self.pinned[url] = order
+
+    def _add_spare(self, entry: Tuple) -> None:
+        bisect.insort(self.spare, (-entry[0], -entry[1], -entry[2], entry[3]))
+        if len(self.spare) > self.cap:
+            self.spare.pop()
+            self.overflow += 1
+
+    # 加入一个候选，返回被淘汰的地址（可能就是新加入的地址），没有淘汰时返回 None
+    # 比较只看 (优先级, 加入顺序)，所以最终留下的候选与加入的先后无关
+    def add(self, url: str, priority: Tuple[float, float], order: int) -> Optional[str]:
+        entry = (-priority[0], -priority[1], -order, url)
+        if self.cap <= 0 or len(self.heap) < self.cap:
+            heapq.heappush(self.heap, entry)
+            self.kept[url] = entry
+            return None
+        if entry > self.heap[0]:
+            self.kept[url] = entry
+            entry = heapq.heapreplace(self.heap, entry)
+            del self.kept[entry[3]]
+        self._add_spare(entry)
+        return entry[3]
+
+    # 移除一个地址（被其他频道以更靠前的顺序取走）；移除的是保留的候选时，由备选中优先级最高的补位，
+    # 返回补位的 (地址, 优先级)。只要移走的候选不超过备选数，保留的就是现有候选中优先级最高的 cap 个，
+    # 与加入、移除的先后无关。开销与 cap 成正比，与频道见过的地址总数无关
+    def discard(self, url: str) -> Optional[Tuple[str, Tuple[float, float]]]:
+        if self.pinned.pop(url, None) is not None:
+            return None
+        entry = self.kept.pop(url, None)
+        if entry is None:
+            for index, spare_entry in enumerate(self.spare):
+                if spare_entry[3] == url:
+                    del self.spare[index]
+                    break
+            else:
+                # 移走的是连备选也没保留的候选
+                self.overflow -= 1
+            return None
+        self.heap.remove(entry)
+        if not self.spare:
+            heapq.heapify(self.heap)
+            return None
+        refill = self.spare.pop(0)
+        refill_entry = (-refill[0], -refill[1], -refill[2], refill[3])
+        self.heap.append(refill_entry)
+        heapq.heapify(self.heap)
+        self.kept[refill[3]] = refill_entry
+        return (refill[3], (refill[0], refill[1]))
+
+    # 没有保留下来的候选数（备选加上连备选也没保留的）
+    @property
+    def evicted_count(self) -> int:
+        return len(self.spare) + self.overflow
+
+    # 按 (响应时间, 地址) 依次给出：精选源在前（后加入的在前），其余候选按优先级（预计成功率），同级按加入顺序
+    def __iter__(self):
+        for url, _ in sorted(self.pinned.items(), key=lambda item: item[1], reverse=True):
+            yield (0, url)
+        for entry in sorted(self.heap, reverse=True):
+            yield (float('inf'), entry[3])
+
+    def __len__(self) -> int:
+        return len(self.pinned) + len(self.heap)
+
+# 并发解析时的锁分段数：按规范化地址哈希分段保护去重表，按频道名哈希分段保护各频道的候选集合
+INGEST_LOCK_STRIPES = 64
+IMPLICIT_BATCH_BASE = 1 << 20  # 没有指定源序号的批次排在所有指定了序号的源之后
 
 # 频道源管理器
 class ChannelSourceManager:
-    def __init__(self, blacklist: Set[str] = None):
-        self.sources = {}
-        self.seen_urls = set()
-        self.blacklist = blacklist if blacklist else set()
-        
-    def add_source(self, channel_name: str, url: str, skip_validation: bool = False) -> bool:
-        if url in self.seen_urls:
-            return False
-            
-        # 黑名单检查
-        if url in self.blacklist:
-            return False
-            
-        self.seen_urls.add(url)
-        
-        if channel_name not in self.sources:
-            self.sources[channel_name] = []
-        
-        if skip_validation:
-            self.sources[channel_name].insert(0, (0, url))
+    def __init__(self, blacklist: Optional[Iterable[str]] = None, volatile_params: Dict[str, Set[str]] = VOLATILE_QUERY_PARAMS,
+                 validation_store: Optional[ValidationStore] = None, pipeline: Optional[ValidationPipeline] = None,
+                 candidate_cap: int = MAX_CANDIDATES_PER_CHANNEL, dead_filter: Optional[DeadUrlFilter] = None,
+                 lock_stripes: int = INGEST_LOCK_STRIPES):
+        self.sources = {}  # 频道名 -> ChannelCandidates，排序后为 [(响应时间, 地址)]
+        self.candidate_cap = candidate_cap
+        self.cut_short_channels = []  # 时间预算用完时没验证完的频道
+        self.dead_filter = dead_filter
+        self.stream_quality = {}  # 地址 -> HLS深度探测指标
+        self.probe_timings = {}   # 地址 -> 本次运行探测的各阶段耗时
+        self.latency_stats = {}   # 地址 -> 多次采样的延迟统计
+        self.validated_results = {}  # 地址 -> 最近一次排序所用的验证结果
+        self.validation_store = validation_store
+        self.pipeline = pipeline  # 设置后新地址立即送去验证
+        self.seen_urls = {}  # 规范化地址 -> (加入顺序, 频道名, 原始地址)，保留加入顺序最靠前的一个
+        self.volatile_params = volatile_params
+        self.url_variants = {}  # 规范化地址 -> 出现过的不同原始地址（只记录有多种写法的）
+        if isinstance(blacklist, BlacklistIndex):
+            self.blacklist = blacklist
         else:
-            self.sources[channel_name].append((float('inf'), url))
+            self.blacklist = BlacklistIndex(blacklist or ())
+        # 分段锁和分段计数；加锁顺序固定为先地址段后频道段
+        self.lock_stripes = max(1, lock_stripes)
+        self.url_locks = [threading.Lock() for _ in range(self.lock_stripes)]
+        self.channel_locks = [threading.Lock() for _ in range(self.lock_stripes)]
+        self.dead_skipped_counts = [0] * self.lock_stripes  # 被失效地址过滤器跳过的候选数
+        self.batch_counter = itertools.count(IMPLICIT_BATCH_BASE)
+
+    # 原始地址不同但规范化后重复的地址，每个省掉一次探测
+    @property
+    def collapsed_urls(self) -> Set[str]:
+        collapsed = set()
+        for canonical_url, variants in list(self.url_variants.items()):
+            collapsed.update(variants - {self.seen_urls[canonical_url][2]})
+        return collapsed
+
+    @property
+    def evicted_count(self) -> int:
+        return sum(candidates.evicted_count for candidates in list(self.sources.values()) if isinstance(candidates, ChannelCandidates))
+
+    @property
+    def dead_skipped(self) -> int:
+        return sum(self.dead_skipped_counts)
+
+    def _stripe(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self.lock_stripes
+
+    # 清空全部候选和去重记录，之后可以重新加入各源内容（监视模式下源内容变化时使用）
+    def reset_candidates(self) -> None:
+        self.sources = {}
+        self.seen_urls = {}
+        self.url_variants = {}
+        self.dead_skipped_counts = [0] * self.lock_stripes
+        self.batch_counter = itertools.count(IMPLICIT_BATCH_BASE)
         
-        return True
+    # 地址当前是否仍是该频道保留的候选（不含精选源）
+    def is_retained(self, channel_name: str, url: str) -> bool:
+        candidates = self.sources.get(channel_name)
+        return isinstance(candidates, ChannelCandidates) and url in candidates.kept
+
+    # 候选优先级（越小越好）：按历史得分预计的 (失败概率, 延迟)，没有历史的用先验值
+    def candidate_priorities(self, urls: List[str]) -> Dict[str, Tuple[float, float]]:
+        if self.validation_store is None:
+            return {}
+        canonical_by_url = {url: canonicalize_url(url, self.volatile_params) for url in urls}
+        predicted = self.validation_store.predicted_priorities(set(canonical_by_url.values()))
+        return {url: predicted[canonical_url] for url, canonical_url in canonical_by_url.items() if canonical_url in predicted}
+
+    # 可以从多个线程同时调用。order 为加入顺序（源序号 << 32 | 行号），同一地址出现多次时保留 order 最小的，
+    # 所以结果与线程执行的先后无关；不指定时按调用顺序排在所有指定了序号的源之后
+    def add_source(self, channel_name: str, url: str, skip_validation: bool = False,
+                   priority: Optional[Tuple[float, float]] = None, order: Optional[int] = None) -> bool:
+        canonical_url = canonicalize_url(url, self.volatile_params)
+        if order is None:
+            order = next(self.batch_counter) << 32
+        url_stripe = self._stripe(canonical_url)
+        with self.url_locks[url_stripe]:
+            previous = self.seen_urls.get(canonical_url)
+            if previous is not None:
+                if previous[2] != url:
+                    self.url_variants.setdefault(canonical_url, {previous[2]}).add(url)
+                if previous[0] <= order:
+                    return False
+                
+            # 黑名单检查（主机 / 协议 / 路径前缀）
+            if self.blacklist.match(url) is not None:
+                return False
+
+            # 连续多次运行都失效的地址（精选源不受影响）
+            if not skip_validation and self.dead_filter is not None and canonical_url in self.dead_filter:
+                self.dead_skipped_counts[url_stripe] += 1
+                return False
+                
+            self.seen_urls[canonical_url] = (order, channel_name, url)
+
+            # 另一个线程先加入了同一地址但顺序靠后，由这里取代它；原频道的空位由该频道被淘汰的候选补上
+            refilled = None
+            if previous is not None:
+                with self.channel_locks[self._stripe(previous[1])]:
+                    refilled = self.sources[previous[1]].discard(previous[2])
+
+            added = True
+            evicted_url = None
+            with self.channel_locks[self._stripe(channel_name)]:
+                candidates = self.sources.get(channel_name)
+                if candidates is None:
+                    candidates = self.sources[channel_name] = ChannelCandidates(self.candidate_cap)
+                if skip_validation:
+                    candidates.add_pinned(url, order)
+                else:
+                    if priority is None:
+                        priority = self.candidate_priorities([url]).get(url, UNKNOWN_PRIORITY)
+                    evicted_url = candidates.add(url, priority, order)
+                    added = evicted_url != url
+
+        # 只提交保留下来的候选；被淘汰或被移走的候选通知流水线，排队中的不再探测，已合格的不再计入名额
+        if self.pipeline is not None:
+            if previous is not None:
+                self.pipeline.withdraw(previous[1], previous[2])
+            if evicted_url is not None and evicted_url != url:
+                self.pipeline.withdraw(channel_name, evicted_url)
+            if refilled is not None:
+                self.pipeline.submit(previous[1], *refilled)
+            if added and not skip_validation:
+                self.pipeline.submit(channel_name, url, priority)
+        return added
+
+    # 批量添加一个源解析出的全部 (频道名, 地址)，返回新增数量；source_index 为该源在源列表中的序号
+    def add_sources(self, pairs: List[Tuple[str, str]], skip_validation: bool = False, source_index: Optional[int] = None) -> int:
+        added = 0
+        batch = source_index if source_index is not None else next(self.batch_counter)
+        priorities = {} if skip_validation else self.candidate_priorities([url for _, url in pairs])
+        for position, (channel_name, url) in enumerate(pairs):
+            if self.add_source(channel_name, url, skip_validation, priorities.get(url, UNKNOWN_PRIORITY), (batch << 32) | position):
+                added += 1
+        if self.pipeline is not None:
+            self.pipeline.flush()
+        return added
         
-    def validate_and_sort_sources(self, max_workers: int = 20) -> None:
+    # 排序键：me.txt 精选源始终在前；按下载速率排序时，有深度探测结果的源排在没有的前面
+    def rank_key(self, response_time: float, url: str, rank_by: str = RANKING_METRIC) -> Tuple:
+        if rank_by == 'ttfb':
+            timings = self.probe_timings.get(url)
+            return (response_time if response_time == 0 or timings is None else timings.ttfb,)
+        if rank_by != 'throughput':
+            if response_time == 0:
+                return (0,)
+            stats = self.latency_stats.get(url) or LatencyStats(response_time, response_time, 0.0, 1)
+            return (latency_score(stats),)
+        if response_time == 0:
+            return (0, 0, 0)
+        quality = self.stream_quality.get(url)
+        if quality is not None:
+            return (1, -quality.throughput, response_time)
+        return (2, 0, response_time)
+
+    def validate_and_sort_sources(self, max_workers: int = 20, engine: str = VALIDATION_ENGINE,
+                                  deep_probe: bool = VALIDATION_DEEP_PROBE, rank_by: str = RANKING_METRIC,
+                                  top_k: int = VALIDATION_TOP_K, latency_threshold: float = VALIDATION_TOP_K_LATENCY,
+                                  scheduler: Optional[RequestScheduler] = None, samples: int = LATENCY_SAMPLES,
+                                  time_budget: Optional[float] = VALIDATION_TIME_BUDGET, channel_order: Optional[Dict[str, int]] = None) -> None:
         print("开始验证所有源的有效性...")
-        
-        all_urls = []
-        url_to_channel = {}
-        
-        for channel_name, url_list in self.sources.items():
-            for response_time, url in url_list:
-                if response_time == float('inf'):
-                    all_urls.append(url)
-                    url_to_channel[url] = channel_name
-        
-        validated_results = {}
+        validation_started = time.time()
+        known_results, pending_urls = self.collect_pending()
+        deadline = validation_started + time_budget if time_budget else None
+        probe_results = self.probe_pending(pending_urls, known_results, max_workers, engine, deep_probe,
+                                           top_k, latency_threshold, scheduler, channel_order, deadline)
+        self.apply_validation(known_results, probe_results, rank_by, samples, scheduler, validation_started, deadline)
+
+    # 解析入库阶段的统计：规范化去重、候选上限淘汰、失效地址过滤
+    def print_ingest_summary(self) -> None:
+        collapsed_count = len(self.collapsed_urls)
+        print(f"地址规范化去重: 合并 {collapsed_count} 个重复地址, 节省 {collapsed_count} 次探测")
+        print(f"候选上限: 每频道最多 {self.candidate_cap} 个, 淘汰 {self.evicted_count} 个低优先级候选")
+        print(f"失效地址过滤: 跳过 {self.dead_skipped} 个连续 {DEAD_URL_RUNS} 次运行失效的地址")
+
+    # 需要验证的地址：未过期的历史结果直接复用，只探测新地址和已过期的地址
+    def collect_pending(self) -> Tuple[Dict[str, ProbeResult], List[str]]:
+        self.print_ingest_summary()
+        all_urls = [url for url_list in self.sources.values() for response_time, url in url_list if response_time == float('inf')]
+
+        known_results = {}
+        if self.validation_store is not None:
+            canonical_by_url = {url: canonicalize_url(url, self.volatile_params) for url in all_urls}
+            fresh_results = self.validation_store.lookup_fresh(set(canonical_by_url.values()))
+            for url, canonical_url in canonical_by_url.items():
+                if canonical_url in fresh_results:
+                    known_results[url] = fresh_results[canonical_url]
+            print(f"复用未过期的验证结果 {len(known_results)} 条, 需要探测 {len(all_urls) - len(known_results)} 条")
+        return known_results, [url for url in all_urls if url not in known_results]
+
+    def probe_pending(self, all_urls: List[str], known_results: Dict[str, ProbeResult], max_workers: int = 20,
+                      engine: str = VALIDATION_ENGINE, deep_probe: bool = VALIDATION_DEEP_PROBE,
+                      top_k: int = VALIDATION_TOP_K, latency_threshold: float = VALIDATION_TOP_K_LATENCY,
+                      scheduler: Optional[RequestScheduler] = None, channel_order: Optional[Dict[str, int]] = None,
+                      deadline: Optional[float] = None) -> Dict[str, ProbeResult]:
+        probe_results = {}
+        if not all_urls:
+            return probe_results
+        if engine == 'async':
+            # 精选源和未过期的合格结果先计入各频道的 K 个名额
+            pending = set(all_urls)
+            channel_candidates = {}
+            for channel_name, url_list in self.sources.items():
+                urls = [url for _, url in url_list if url in pending]
+                if urls:
+                    channel_candidates[channel_name] = urls
+            initial_good = {}
+            for channel_name in channel_candidates:
+                initial_good[channel_name] = sum(
+                    1 for response_time, url in self.sources[channel_name]
+                    if response_time == 0 or (url in known_results and known_results[url].ok
+                                              and known_results[url].latency is not None
+                                              and known_results[url].latency <= latency_threshold)
+                )
+            validator = AsyncStreamValidator(deep_probe=deep_probe, scheduler=scheduler)
+            probe_results = validator.validate_detailed(all_urls, channel_candidates, initial_good, top_k, latency_threshold,
+                                                        channel_order, deadline)
+            self.cut_short_channels = validator.cut_short
+            return probe_results
+
+        dns_cache = DnsCache()
+        dns_cache.prefetch(urlparse(url).hostname for url in all_urls)
+        thread_scheduler = scheduler if scheduler is not None else RequestScheduler()
+
+        def probe(url: str) -> ProbeResult:
+            host = (urlparse(url).hostname or '').lower()
+            thread_scheduler.acquire(host, 'probe')
+            try:
+                return probe_stream_url(url, dns_cache=dns_cache)
+            finally:
+                thread_scheduler.release(host)
+
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(validate_stream_url, url): url for url in all_urls}
+            future_to_url = {executor.submit(probe, url): url for url in all_urls}
             for future in concurrent.futures.as_completed(future_to_url):
                 url = future_to_url[future]
                 try:
-                    is_valid, response_time = future.result()
-                    validated_results[url] = (is_valid, response_time)
+                    probe_results[url] = future.result()
                 except Exception as e:
-                    validated_results[url] = (False, None)
+                    probe_results[url] = ProbeResult(False, None, 'error')
+        return probe_results
+
+    # 记录探测结果并排序，每个频道保留前 MAX_SOURCES_PER_CHANNEL 个
+    def apply_validation(self, known_results: Dict[str, ProbeResult], probe_results: Dict[str, ProbeResult],
+                         rank_by: str = RANKING_METRIC, samples: int = LATENCY_SAMPLES,
+                         scheduler: Optional[RequestScheduler] = None, validation_started: Optional[float] = None,
+                         deadline: Optional[float] = None) -> None:
+        validated_results = dict(known_results)
+        validated_results.update(probe_results)
+        self.validated_results = validated_results
+        for url, result in validated_results.items():
+            if result.ok and result.quality is not None:
+                self.stream_quality[url] = result.quality
+            if result.ok and result.timings is not None:
+                self.probe_timings[url] = result.timings
+        self.record_results(probe_results)
+
+        # 时间预算已经用完时不再补充采样，直接用首次验证的延迟排序
+        budget_spent = bool(self.cut_short_channels) or (deadline is not None and time.time() >= deadline)
+        sampled_urls = {}
+        if samples > 1 and rank_by == 'latency' and not budget_spent:
+            sampled_urls = self.sample_borderline_sources(validated_results, samples, set(probe_results), scheduler, validation_started)
         
         for channel_name in list(self.sources.keys()):
+            # 补充采样过的频道只在采样过的候选中排序，整个频道按同一统计量比较
+            channel_sampled = sampled_urls.get(channel_name)
             valid_sources = []
             for response_time, url in self.sources[channel_name]:
                 if response_time == 0:
                     valid_sources.append((0, url))
+                elif channel_sampled is not None and url not in channel_sampled:
+                    continue
                 elif url in validated_results:
-                    is_valid, actual_response_time = validated_results[url]
+                    is_valid, actual_response_time = validated_results[url][:2]
                     if is_valid and actual_response_time is not None:
                         valid_sources.append((actual_response_time, url))
             
-            valid_sources.sort(key=lambda x: x[0])
-            self.sources[channel_name] = valid_sources[:10]
+            self.sources[channel_name] = heapq.nsmallest(MAX_SOURCES_PER_CHANNEL, valid_sources,
+                                                         key=lambda x: self.rank_key(x[0], x[1], rank_by))
+
+    # 把一次运行的探测结果写入验证结果库：历史结果、得分、连续失败次数，失败次数达到阈值的记入失效地址过滤器
+    def record_results(self, probe_results: Dict[str, ProbeResult]) -> None:
+        if self.validation_store is None:
+            return
+        # 被主机短路跳过的地址实际没有探测，不计入历史结果和连续失败次数
+        canonical_results = {canonicalize_url(url, self.volatile_params): result for url, result in probe_results.items()
+                             if result.error != 'host-down'}
+        self.validation_store.record_many(canonical_results)
+        channels = {canonicalize_url(url, self.volatile_params): channel_name
+                    for channel_name, url_list in self.sources.items() for _, url in url_list
+                    if url in probe_results and probe_results[url].error != 'host-down'}
+        self.validation_store.update_scores(canonical_results, channels)
+        if self.dead_filter is not None:
+            failed_urls = [url for url, result in canonical_results.items() if not result.ok]
+            for url, failures in self.validation_store.failure_counts(failed_urls).items():
+                if failures >= DEAD_URL_RUNS:
+                    self.dead_filter.add(url)
+
+    # 保留名额有竞争的频道，按首次延迟取前 (名额 + LATENCY_SAMPLE_MARGIN) 个候选补充采样，计算 p50 / p95 / 抖动；
+    # 首次样本只采用本次运行实际探测的结果（fresh_urls），复用的历史延迟不计入。返回 频道名 -> 采样过的地址
+    def sample_borderline_sources(self, validated_results: Dict[str, ProbeResult], samples: int, fresh_urls: Set[str],
+                                  scheduler: Optional[RequestScheduler] = None, since: Optional[float] = None) -> Dict[str, Set[str]]:
+        sampled_urls = {}
+        first_samples = {}  # 地址 -> 本次运行的首次延迟，复用的结果为 None
+        for channel_name, url_list in self.sources.items():
+            pinned_count = sum(1 for response_time, _ in url_list if response_time == 0)
+            measured = sorted(
+                (validated_results[url].latency, url) for response_time, url in url_list
+                if response_time != 0 and url in validated_results and validated_results[url].ok and validated_results[url].latency is not None
+            )
+            cutoff = MAX_SOURCES_PER_CHANNEL - pinned_count
+            # 精选源已占满名额，或者候选都能入选时，采样不会改变结果
+            if cutoff <= 0 or len(measured) <= cutoff:
+                continue
+            window = [url for _, url in measured[:cutoff + LATENCY_SAMPLE_MARGIN]]
+            sampled_urls[channel_name] = set(window)
+            for url in window:
+                first_samples[url] = validated_results[url].latency if url in fresh_urls else None
+        if not first_samples:
+            return {}
+
+        # 有复用结果时多采一轮，保证每个地址的样本数相同
+        rounds = samples if None in first_samples.values() else samples - 1
+        extra_samples = AsyncStreamValidator(scheduler=scheduler).sample_latencies(list(first_samples), rounds, since=since)
+        for url, latencies in extra_samples.items():
+            first = first_samples[url]
+            values = ([first] + latencies) if first is not None else latencies
+            self.latency_stats[url] = summarize_latencies(values[:samples])
+        return sampled_urls
     
     def get_sorted_lines(self, channel_dictionary: List[str], group_title: str) -> List[str]:
         result = []
@@ -255,68 +2228,354 @@ class ChannelSourceManager:
                     result.append(f"{channel_name},{url}")
         return result
 
+# 解析频道行，返回 (分类, 频道名, 地址)；需要跳过或无法分类时返回 None
+def parse_channel_line(line: str, channel_dictionaries: Dict[str, List[str]]) -> Optional[Tuple[str, str, str]]:
+    if "#genre#" in line or "#EXTINF:" in line or "," not in line or "://" not in line:
+        return None
+
+    parts = line.split(',', 1)
+    if len(parts) < 2:
+        return None
+
+    channel_name, channel_address = parts
+    original_name = channel_name  # 保存原始名称
+    channel_name = normalize_channel_name(channel_name)
+
+    channel_address = channel_address.strip()
+
+    # 检查是否为IPv6地址，如果是则跳过
+    if re.search(r'\[[0-9a-fA-F:]+\]|ipv6|240[89e]:', channel_address, re.IGNORECASE):
+        return None
+
+    # 分配到正确的频道分类
+    category = find_channel_category(channel_name, channel_dictionaries)
+    if category is not None:
+        return category, channel_name, channel_address
+
+    print(f"未分类频道: {channel_name}, {channel_address} (原始名称: {original_name})")
+    return None
+
 # 处理频道行
 def process_channel_line(line: str, source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]], skip_validation: bool = False) -> None:
     try:
-        if "#genre#" not in line and "#EXTINF:" not in line and "," in line and "://" in line:
-            parts = line.split(',', 1)
-            if len(parts) < 2:
-                return
-                
-            channel_name, channel_address = parts
-            original_name = channel_name  # 保存原始名称
-            channel_name = traditional_to_simplified(channel_name)
-            channel_name = clean_channel_name(channel_name)
-            
-            channel_address = channel_address.strip()
-            
-            # 检查是否为IPv6地址，如果是则跳过
-            if re.search(r'\[[0-9a-fA-F:]+\]|ipv6|240[89e]:', channel_address, re.IGNORECASE):
-                return
+        parsed = parse_channel_line(line, channel_dictionaries)
+        if parsed is None:
+            return
 
-            # 分配到正确的频道分类
-            for category, dictionary in channel_dictionaries.items():
-                if channel_name in dictionary:
-                    if source_manager.add_source(channel_name, channel_address, skip_validation):
-                        print(f"添加到{category}: {channel_name}, {channel_address}")
-                    return
-            
-            print(f"未分类频道: {channel_name}, {channel_address} (原始名称: {original_name})")
+        category, channel_name, channel_address = parsed
+        if source_manager.add_source(channel_name, channel_address, skip_validation):
+            print(f"添加到{category}: {channel_name}, {channel_address}")
     except Exception as e:
         print(f"处理频道行时出错: {e}")
 
-# 处理URL
-def process_url(url: str, source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]]) -> None:
-    print(f"\n开始处理URL: {url}")
+# 条件请求缓存：保存 ETag / Last-Modified 和内容，未变化的源只需一次 304 往返
+class FetchCache:
+    def __init__(self, cache_dir: str = os.path.join(CACHE_DIR, 'fetch')):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        self.seconds_saved = 0.0
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取下载缓存索引失败，将重新建立: {e}")
+
+    def _body_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.body')
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry and os.path.exists(self._body_path(url)):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def load_not_modified(self, url: str, elapsed: float) -> Optional[bytes]:
+        try:
+            with open(self._body_path(url), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(url, {})
+            self.hits += 1
+            self.bytes_saved += len(data)
+            self.seconds_saved += max(0.0, entry.get('download_seconds', 0.0) - elapsed)
+        return data
+
+    def store(self, url: str, data: bytes, response_headers, elapsed: float) -> None:
+        with self.lock:
+            self.misses += 1
+            self.bytes_downloaded += len(data)
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._body_path(url), 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            print(f"写入下载缓存失败: {url} {e}")
+            return
+        with self.lock:
+            self.entries[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': len(data),
+                'download_seconds': elapsed
+            }
+
+    def save(self) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = self.index_file + '.tmp'
+            with self.lock:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"保存下载缓存索引失败: {e}")
+
+    def summary(self) -> str:
+        return (f"下载缓存: 命中 {self.hits} 次, 未命中 {self.misses} 次, "
+                f"节省 {self.bytes_saved / 1024:.1f} KB / 约 {self.seconds_saved:.2f} 秒, "
+                f"实际下载 {self.bytes_downloaded / 1024:.1f} KB")
+
+# 下载源内容
+def fetch_url_bytes(url: str, timeout: int = FETCH_TIMEOUT, cache: Optional[FetchCache] = None) -> Optional[bytes]:
+    start_time = time.time()
     try:
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        if cache is not None:
+            headers.update(cache.conditional_headers(url))
         req = urllib.request.Request(url, headers=headers)
-        
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
             data = response.read()
-            encodings = ['utf-8', 'gbk', 'iso-8859-1']
-            text = None
-            
-            for encoding in encodings:
+            if cache is not None:
+                cache.store(url, data, response.headers, time.time() - start_time)
+            return data
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cache is not None:
+            data = cache.load_not_modified(url, time.time() - start_time)
+            if data is not None:
+                return data
+            # 缓存文件丢失，去掉条件头重新下载
+            return fetch_url_bytes(url, timeout)
+        print(f"下载URL时发生错误：{url} {e}")
+        return None
+    except Exception as e:
+        print(f"下载URL时发生错误：{url} {e}")
+        return None
+
+# 源内容解码
+def decode_source_bytes(data: bytes) -> Optional[str]:
+    encodings = ['utf-8', 'gbk', 'iso-8859-1']
+    for encoding in encodings:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+# 解析整个源内容，返回规范化后的 (频道名, 地址) 列表
+def parse_source_text(text: str, channel_dictionaries: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    text = process_m3u_content(text)
+    lines = text.split('\n')
+
+    pairs = []
+    for line in lines:
+        if "#genre#" not in line and "," in line and "://" in line:
+            try:
+                parsed = parse_channel_line(line, channel_dictionaries)
+            except Exception as e:
+                print(f"处理频道行时出错: {e}")
+                continue
+            if parsed is not None:
+                pairs.append((parsed[1], parsed[2]))
+    return pairs
+
+# 解析结果缓存：源内容与频道字典都未变化时，直接复用上次解析出的 (频道名, 地址)
+PARSE_CACHE_VERSION = 4  # 修改解析或名称清理逻辑时递增，使旧缓存失效
+
+class ParseCache:
+    def __init__(self, channel_dictionaries: Dict[str, List[str]], cache_dir: str = os.path.join(CACHE_DIR, 'parse')):
+        self.cache_dir = cache_dir
+        self.fingerprint = self.make_fingerprint(channel_dictionaries)
+        self.used_keys = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # 解析线程并发读写时保护计数
+
+    @staticmethod
+    def make_fingerprint(channel_dictionaries: Dict[str, List[str]]) -> str:
+        payload = json.dumps({
+            'version': PARSE_CACHE_VERSION,
+            'dictionaries': channel_dictionaries,
+            'removal_list': removal_list,
+            'replacements': name_replacements
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def key_for(self, data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()[:32] + '-' + self.fingerprint[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key: str) -> Optional[List[Tuple[str, str]]]:
+        self.used_keys.add(key)
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                pairs = [(channel_name, url) for channel_name, url in json.load(f)]
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            print(f"读取解析缓存失败: {e}")
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return pairs
+
+    def put(self, key: str, pairs: List[Tuple[str, str]]) -> None:
+        self.used_keys.add(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._path(key), 'w', encoding='utf-8') as f:
+                json.dump(pairs, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"写入解析缓存失败: {e}")
+
+    # 删除本次运行未用到的缓存文件，避免目录无限增长
+    def prune(self) -> None:
+        if not os.path.isdir(self.cache_dir):
+            return
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.json') and file_name[:-5] not in self.used_keys:
                 try:
-                    text = data.decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if text is None:
-                print("无法确定合适的编码格式进行解码。")
-                return
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+
+    def summary(self) -> str:
+        return f"解析缓存: 命中 {self.hits} 个源, 未命中 {self.misses} 个源"
+
+# 已下载的源数据解析为 (频道名, 地址) 列表，返回 (列表, 是否命中解析缓存)；无法解码时列表为 None
+def parse_source_bytes(data: bytes, channel_dictionaries: Dict[str, List[str]],
+                       parse_cache: Optional[ParseCache] = None) -> Tuple[Optional[List[Tuple[str, str]]], bool]:
+    cache_key = parse_cache.key_for(data) if parse_cache is not None else None
+    if cache_key is not None:
+        pairs = parse_cache.get(cache_key)
+        if pairs is not None:
+            return pairs, True
+
+    text = decode_source_bytes(data)
+    if text is None:
+        return None, False
+
+    pairs = parse_source_text(text, channel_dictionaries)
+    if cache_key is not None:
+        parse_cache.put(cache_key, pairs)
+    return pairs, False
+
+# 处理已下载的源数据，返回解析出的 (频道名, 地址) 列表
+def process_source_bytes(data: bytes, source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]], parse_cache: Optional[ParseCache] = None,
+                         source_index: Optional[int] = None) -> List[Tuple[str, str]]:
+    try:
+        pairs, cached = parse_source_bytes(data, channel_dictionaries, parse_cache)
+        if pairs is None:
+            print("无法确定合适的编码格式进行解码。")
+            return []
+
+        added = source_manager.add_sources(pairs, source_index=source_index)
+        if cached:
+            print(f"内容未变化，复用解析缓存: {len(pairs)} 条已分类源, 新增 {added} 条")
+        else:
+            print(f"解析到 {len(pairs)} 条已分类源, 新增 {added} 条")
+        return pairs
 
-            text = process_m3u_content(text)
-            lines = text.split('\n')
-            
-            for line in lines:
-                if "#genre#" not in line and "," in line and "://" in line:
-                    process_channel_line(line, source_manager, channel_dictionaries)
-                    
     except Exception as e:
         print(f"处理URL时发生错误：{e}")
+        return []
+
+# 并发下载所有源，按输入顺序返回 (url, 内容)
+def fetch_all_sources(urls: List[str], max_workers: int = FETCH_MAX_WORKERS, per_host_limit: int = FETCH_PER_HOST_LIMIT, cache: Optional[FetchCache] = None,
+                      scheduler: Optional[RequestScheduler] = None,
+                      on_fetched: Optional[Callable[[int, str, Optional[bytes]], None]] = None) -> List[Tuple[str, Optional[bytes]]]:
+    # 去重并保持原有顺序，urls.txt 中同一个源经常出现多次
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return []
+
+    # 没有共用的调度器时，只按 per_host_limit 限制单主机并发
+    if scheduler is None:
+        scheduler = RequestScheduler(rate=None, per_host_limit=per_host_limit, host_limits={})
+
+    # on_fetched 在下载线程中立即回调（参数为源序号），用于并发解析
+    source_index = {url: index for index, url in enumerate(unique_urls)}
+
+    def fetch(url: str) -> Tuple[Optional[bytes], float]:
+        host = (urlparse(url).hostname or '').lower()
+        scheduler.acquire(host, 'fetch')
+        try:
+            start_time = time.time()
+            data = fetch_url_bytes(url, cache=cache)
+            elapsed = time.time() - start_time
+        finally:
+            scheduler.release(host)
+        if on_fetched is not None:
+            on_fetched(source_index[url], url, data)
+        return data, elapsed
+
+    # 按主机轮流提交，避免同一主机的请求占满线程池
+    by_host = {}
+    for url in unique_urls:
+        by_host.setdefault((urlparse(url).hostname or '').lower(), []).append(url)
+    submit_order = []
+    while by_host:
+        for host in list(by_host):
+            submit_order.append(by_host[host].pop(0))
+            if not by_host[host]:
+                del by_host[host]
+
+    results = {}
+    fetch_start = time.time()
+    total_latency = 0.0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        future_to_url = {executor.submit(fetch, url): url for url in submit_order}
+        for future in concurrent.futures.as_completed(future_to_url):
+            url = future_to_url[future]
+            try:
+                data, elapsed = future.result()
+            except Exception as e:
+                print(f"下载URL时发生错误：{url} {e}")
+                data, elapsed = None, 0.0
+            total_latency += elapsed
+            results[url] = data
+            size = len(data) if data is not None else 0
+            print(f"下载完成: {url} ({size} 字节, {elapsed:.2f} 秒)")
+
+    print(f"源下载完成: {len(unique_urls)} 个源, 耗时 {time.time() - fetch_start:.2f} 秒 (顺序下载约需 {total_latency:.2f} 秒)")
+    if cache is not None:
+        cache.save()
+        print(cache.summary())
+    return [(url, results.get(url)) for url in unique_urls]
 
 # 处理精选源文件
 def process_me_file(source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]]) -> None:
@@ -327,39 +2586,196 @@ def process_me_file(source_manager: ChannelSourceManager, channel_dictionaries:
         if line.strip() and "," in line and "://" in line:
             process_channel_line(line, source_manager, channel_dictionaries, skip_validation=True)
 
-# 主函数
-def main():
-    print("正在读取黑名单...")
-    # 只读取blackhost_count.txt作为黑名单
-    blacklist = read_list_from_txt('assets/whitelist-blacklist/blackhost_count.txt')
-    print(f"黑名单行数: {len(blacklist)}")
+# 分片验证：主进程导出候选文件，各进程 / 主机按主机哈希验证自己的分片，最后合并结果文件排序输出
+CANDIDATES_FILE = os.path.join(CACHE_DIR, 'candidates.json')
+SHARD_DIR = os.path.join(CACHE_DIR, 'shards')
 
-    print("正在读取白名单...")
-    whitelist = read_list_from_txt('assets/whitelist-blacklist/whitelist.txt', is_blacklist=False)
-    print(f"白名单行数: {len(whitelist)}")
+def probe_result_to_json(result: ProbeResult) -> Dict:
+    return {
+        'ok': result.ok,
+        'latency': result.latency,
+        'error': result.error,
+        'quality': list(result.quality) if result.quality is not None else None,
+        'timings': list(result.timings) if result.timings is not None else None,
+    }
 
-    print("正在读取频道字典...")
-    channel_dictionaries = load_channel_dictionaries()
+def probe_result_from_json(data: Dict) -> ProbeResult:
+    quality = StreamQuality(*data['quality']) if data.get('quality') is not None else None
+    timings = ProbeTimings(*data['timings']) if data.get('timings') is not None else None
+    return ProbeResult(data['ok'], data['latency'], data.get('error', ''), quality, timings)
 
-    print("正在读取URL列表...")
-    urls = read_txt_to_array('assets/urls.txt')
-    print(f"读取到 {len(urls)} 个URL")
+def write_json_atomic(path: str, data) -> None:
+    write_text_atomic(path, json.dumps(data, ensure_ascii=False))
 
-    # 创建频道源管理器，传入黑名单
-    source_manager = ChannelSourceManager(blacklist=set(blacklist))
+# 先写临时文件再替换，读取方不会看到写了一半的文件
+def write_text_atomic(path: str, text: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
 
-    # 处理所有URL
-    print("\n开始处理所有URL...")
-    for url in urls:
-        if url.startswith("http"):
-            process_url(url, source_manager, channel_dictionaries)
+# 同一主机的地址总是落在同一个分片，单主机并发限制在分片内依然有效
+def shard_of(url: str, shard_count: int) -> int:
+    host = (urlparse(url).hostname or '').lower()
+    return int(hashlib.md5(host.encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+def parse_shard_spec(spec: str) -> Tuple[int, int]:
+    index, count = (int(part) for part in spec.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"无效的分片: {spec}")
+    return index, count
+
+def shard_output_path(shard_index: int, shard_count: int) -> str:
+    return os.path.join(SHARD_DIR, f"shard-{shard_index}-of-{shard_count}.json")
+
+# 导出去重后的候选：各频道的源、可复用的历史结果、需要探测的地址，返回需要探测的数量
+def export_candidates(source_manager: ChannelSourceManager, path: str = CANDIDATES_FILE) -> int:
+    known_results, pending_urls = source_manager.collect_pending()
+    write_json_atomic(path, {
+        'sources': {channel_name: [[None if response_time == float('inf') else response_time, url] for response_time, url in url_list]
+                    for channel_name, url_list in source_manager.sources.items()},
+        'known': {url: probe_result_to_json(result) for url, result in known_results.items()},
+        'pending': pending_urls,
+    })
+    return len(pending_urls)
+
+# 把候选文件载入管理器，返回 (可复用的历史结果, 需要探测的地址)
+def load_candidates(path: str, source_manager: ChannelSourceManager) -> Tuple[Dict[str, ProbeResult], List[str]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for channel_name, url_list in data['sources'].items():
+        source_manager.sources[channel_name] = [(float('inf') if response_time is None else response_time, url)
+                                                for response_time, url in url_list]
+    known_results = {url: probe_result_from_json(result) for url, result in data['known'].items()}
+    return known_results, data['pending']
+
+# 验证一个分片并写出结果文件，返回探测数量
+def validate_shard(candidates_path: str, shard_index: int, shard_count: int, output_path: str,
+                   engine: str = VALIDATION_ENGINE, rate: Optional[float] = REQUEST_RATE_LIMIT) -> int:
+    source_manager = ChannelSourceManager()
+    known_results, pending_urls = load_candidates(candidates_path, source_manager)
+    shard_urls = [url for url in pending_urls if shard_of(url, shard_count) == shard_index]
+    print(f"分片 {shard_index}/{shard_count}: 需要探测 {len(shard_urls)} / {len(pending_urls)} 个地址")
+    probe_results = source_manager.probe_pending(shard_urls, known_results, engine=engine, scheduler=RequestScheduler(rate=rate))
+    write_json_atomic(output_path, {
+        'shard': [shard_index, shard_count],
+        'results': {url: probe_result_to_json(result) for url, result in probe_results.items()},
+    })
+    return len(probe_results)
+
+def merge_shard_results(paths: List[str]) -> Dict[str, ProbeResult]:
+    results = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for url, result in data['results'].items():
+            results[url] = probe_result_from_json(result)
+    print(f"合并分片结果: {len(paths)} 个文件, {len(results)} 条探测结果")
+    return results
+
+# 本机多进程验证：每个进程一个分片，全局请求速率按进程数平分
+def validate_with_processes(source_manager: ChannelSourceManager, processes: int, rank_by: str = RANKING_METRIC,
+                            scheduler: Optional[RequestScheduler] = None) -> None:
+    print(f"开始分片验证所有源的有效性 ({processes} 个进程)...")
+    validation_started = time.time()
+    export_candidates(source_manager, CANDIDATES_FILE)
+    known_results, _ = load_candidates(CANDIDATES_FILE, source_manager)
+    rate = REQUEST_RATE_LIMIT / processes if REQUEST_RATE_LIMIT is not None else None
+    output_paths = [shard_output_path(index, processes) for index in range(processes)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(validate_shard, CANDIDATES_FILE, index, processes, output_paths[index], VALIDATION_ENGINE, rate)
+                   for index in range(processes)]
+        for future in futures:
+            future.result()
+    source_manager.apply_validation(known_results, merge_shard_results(output_paths), rank_by,
+                                    scheduler=scheduler, validation_started=validation_started)
+    print(f"分片验证完成, 耗时 {time.time() - validation_started:.2f} 秒")
+
+# 阶段产物：每个阶段结束时保存一份，之后可以用 --from-stage 从任意阶段重新开始，不必重新下载和解析
+PIPELINE_STAGES = ['fetch', 'parse', 'validate', 'rank', 'output']
+STAGE_DIR = os.path.join(CACHE_DIR, 'stages')
 
-    # 处理精选源文件
-    process_me_file(source_manager, channel_dictionaries)
+class StageArtifacts:
+    def __init__(self, stage_dir: str = STAGE_DIR):
+        self.stage_dir = stage_dir
 
-    # 验证所有源并选择最快的10个
-    source_manager.validate_and_sort_sources()
+    def _path(self, name: str) -> str:
+        return os.path.join(self.stage_dir, name)
 
+    def _load_json(self, name: str):
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise SystemExit(f"缺少阶段产物 {self._path(name)}，请先完整运行一次")
+
+    # fetch：各源的原始内容，按地址哈希压缩保存，清单记录源的顺序
+    def save_fetched(self, fetched_sources: List[Tuple[str, Optional[bytes]]]) -> None:
+        body_dir = self._path('fetch')
+        os.makedirs(body_dir, exist_ok=True)
+        manifest = []
+        for url, data in fetched_sources:
+            if data is None:
+                manifest.append([url, None])
+                continue
+            key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+            with open(os.path.join(body_dir, key + '.z'), 'wb') as f:
+                f.write(zlib.compress(data, 6))
+            manifest.append([url, key])
+        write_json_atomic(self._path('fetch.json'), manifest)
+
+    def load_fetched(self) -> List[Tuple[str, Optional[bytes]]]:
+        fetched_sources = []
+        for url, key in self._load_json('fetch.json'):
+            data = None
+            if key is not None:
+                with open(os.path.join(self._path('fetch'), key + '.z'), 'rb') as f:
+                    data = zlib.decompress(f.read())
+            fetched_sources.append((url, data))
+        return fetched_sources
+
+    # parse：解析、去重、加入精选源之后各频道的候选
+    def save_candidates(self, source_manager: ChannelSourceManager) -> None:
+        write_json_atomic(self._path('candidates.json'), {
+            channel_name: [[None if response_time == float('inf') else response_time, url] for response_time, url in url_list]
+            for channel_name, url_list in source_manager.sources.items()
+        })
+
+    def load_candidates(self, source_manager: ChannelSourceManager) -> None:
+        for channel_name, url_list in self._load_json('candidates.json').items():
+            source_manager.sources[channel_name] = [(float('inf') if response_time is None else response_time, url)
+                                                    for response_time, url in url_list]
+
+    # validate：全部验证结果（含复用的历史结果）和补充采样得到的延迟统计
+    def save_validation(self, source_manager: ChannelSourceManager) -> None:
+        write_json_atomic(self._path('validation.json'), {
+            'results': {url: probe_result_to_json(result) for url, result in source_manager.validated_results.items()},
+            'latency_stats': {url: list(stats) for url, stats in source_manager.latency_stats.items()},
+        })
+
+    def load_validation(self, source_manager: ChannelSourceManager) -> Dict[str, ProbeResult]:
+        data = self._load_json('validation.json')
+        source_manager.latency_stats = {url: LatencyStats(*stats) for url, stats in data['latency_stats'].items()}
+        return {url: probe_result_from_json(result) for url, result in data['results'].items()}
+
+    # rank：排序后每个频道保留的源
+    def save_ranked(self, source_manager: ChannelSourceManager) -> None:
+        write_json_atomic(self._path('ranked.json'), {
+            channel_name: [list(item) for item in url_list] for channel_name, url_list in source_manager.sources.items()
+        })
+
+    def load_ranked(self, source_manager: ChannelSourceManager) -> None:
+        for channel_name, url_list in self._load_json('ranked.json').items():
+            source_manager.sources[channel_name] = [(response_time, url) for response_time, url in url_list]
+
+M3U_OUTPUT_FILE = "tv202303.m3u"
+TXT_OUTPUT_FILE = "tv202303.txt"
+
+# 按分类生成并保存 M3U 和 TXT 文件，返回输出的频道数
+def write_outputs(source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]]) -> int:
     # 获取当前的 UTC 时间
     beijing_time = datetime.now(timezone.utc) + timedelta(hours=8)
     formatted_time = beijing_time.strftime("%Y%m%d %H:%M")
@@ -392,6 +2808,13 @@ def main():
     # 获取处理后的频道源并添加到M3U和TXT文件
     total_count = 0
     categories_order = ['zh', 'ys', 'ws', 'gj', 'gd', 'hain', 'dy', 'zb']
+
+    # 其他地方台（分类名即文件名）排在海南频道之后，字典为空的不输出
+    local_categories = [key for key in channel_dictionaries if key not in category_names and channel_dictionaries[key]]
+    for key in local_categories:
+        category_names[key] = key
+    hain_position = categories_order.index('hain') + 1
+    categories_order[hain_position:hain_position] = local_categories
     
     for category in categories_order:
         name = category_names[category]
@@ -414,22 +2837,374 @@ def main():
         all_txt_lines.append('')
 
     # 保存M3U文件
-    m3u_output_file = "tv202303.m3u"
     try:
-        with open(m3u_output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(all_m3u_lines))
-        print(f"M3U文件已保存到: {m3u_output_file}")
+        write_text_atomic(M3U_OUTPUT_FILE, '\n'.join(all_m3u_lines))
+        print(f"M3U文件已保存到: {M3U_OUTPUT_FILE}")
     except Exception as e:
         print(f"保存M3U文件时发生错误：{e}")
 
     # 保存TXT文件
-    txt_output_file = "tv202303.txt"
     try:
-        with open(txt_output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(all_txt_lines))
-        print(f"TXT文件已保存到: {txt_output_file}")
+        write_text_atomic(TXT_OUTPUT_FILE, '\n'.join(all_txt_lines))
+        print(f"TXT文件已保存到: {TXT_OUTPUT_FILE}")
     except Exception as e:
         print(f"保存TXT文件时发生错误：{e}")
+    return total_count
+
+
+# 监视模式：常驻内存，按各自的间隔重新下载源、按排名轮流复验地址，排名变化时才重写输出文件
+WATCH_TICK = 5                     # 每轮间隔（秒）
+WATCH_PROBE_RATE = 2               # 监视模式下的稳定请求速率（每秒），复验和下载共用
+WATCH_REVALIDATE_INTERVALS = (600, 3600, 6 * 3600)  # 复验间隔（秒）：入选的源 / 其余有效候选 / 无效候选
+WATCH_REFETCH_INTERVAL = 1800      # 源的基础下载间隔（秒），内容未变化时逐次翻倍
+WATCH_REFETCH_MAX_INTERVAL = 6 * 3600
+WATCH_RUN_PERIOD = 24 * 3600       # 复验结果按周期汇总写入验证结果库（每个地址每周期计一次），与每日运行的间隔一致
+
+class SourceWatcher:
+    def __init__(self, source_manager: ChannelSourceManager, channel_dictionaries: Dict[str, List[str]],
+                 source_pairs: Dict[str, List[Tuple[str, str]]], fetch_cache: Optional[FetchCache] = None,
+                 parse_cache: Optional[ParseCache] = None, probe_rate: float = WATCH_PROBE_RATE, tick: float = WATCH_TICK,
+                 revalidate_intervals: Tuple[float, float, float] = WATCH_REVALIDATE_INTERVALS,
+                 refetch_interval: float = WATCH_REFETCH_INTERVAL, refetch_max_interval: float = WATCH_REFETCH_MAX_INTERVAL,
+                 run_period: float = WATCH_RUN_PERIOD):
+        self.source_manager = source_manager
+        self.channel_dictionaries = channel_dictionaries
+        self.source_pairs = dict(source_pairs)  # 源地址 -> 上次解析出的 (频道名, 地址)，按源列表顺序
+        self.fetch_cache = fetch_cache
+        self.parse_cache = parse_cache
+        self.tick = tick
+        self.batch_size = max(1, int(probe_rate * tick))
+        self.scheduler = RequestScheduler(rate=probe_rate, burst=1)
+        self.dns_cache = DnsCache()
+        self.revalidate_intervals = revalidate_intervals
+        self.refetch_interval = refetch_interval
+        self.refetch_max_interval = refetch_max_interval
+        self.run_period = run_period
+
+        self.candidates = {}  # 频道名 -> [(响应时间, 地址)]，全部候选（排序前）
+        self.results = dict(source_manager.validated_results)  # 地址 -> 最近一次验证结果
+        self.samples = {url: deque([result.latency], maxlen=LATENCY_SAMPLES)
+                        for url, result in self.results.items() if result.ok and result.latency is not None}
+        self.rank_position = {}  # 入选的地址 -> 在频道内的名次
+        self.ranking = self._ranking()
+
+        # 到期队列 (到期时间, 地址)，地址的到期时间改变后旧条目作废
+        self.due_at = {}
+        self.due_heap = []
+        self.source_interval = {url: refetch_interval for url in self.source_pairs}
+        now = time.time()
+        self.source_heap = [(now + refetch_interval * ValidationStore._spread(url), url) for url in self.source_pairs]
+        heapq.heapify(self.source_heap)
+        self.probe_count = 0
+        self.rewrite_count = 0
+        self.output_count = None  # 最近一次重写输出的频道数
+        self.run_results = {}  # 本周期内各地址最近一次的复验结果，周期结束时一次写入验证结果库
+        self.run_started = now
+
+    def _ranking(self) -> Dict[str, List[str]]:
+        ranking = {channel_name: [url for _, url in url_list] for channel_name, url_list in self.source_manager.sources.items() if url_list}
+        self.rank_position = {url: position for url_list in ranking.values() for position, url in enumerate(url_list)}
+        return ranking
+
+    # 复验间隔：入选的源按名次从短到长（第一名最频繁），未入选的有效候选其次，无效候选最长
+    def _revalidate_interval(self, url: str) -> float:
+        ranked_interval, valid_interval, invalid_interval = self.revalidate_intervals
+        position = self.rank_position.get(url)
+        if position is not None:
+            return ranked_interval * (1 + position / MAX_SOURCES_PER_CHANNEL)
+        result = self.results.get(url)
+        return valid_interval if result is not None and result.ok else invalid_interval
+
+    def _schedule(self, url: str, due: float) -> None:
+        self.due_at[url] = due
+        heapq.heappush(self.due_heap, (due, url))
+
+    # 用内存中各源的解析结果重新生成候选；没有验证结果的新地址立即排队，已有结果的按间隔分散排队
+    def rebuild(self) -> None:
+        self.source_manager.reset_candidates()
+        for source_index, pairs in enumerate(self.source_pairs.values()):
+            self.source_manager.add_sources(pairs, source_index=source_index)
+        process_me_file(self.source_manager, self.channel_dictionaries)
+        self.candidates = {channel_name: list(url_list) for channel_name, url_list in self.source_manager.sources.items()}
+
+        now = time.time()
+        pending = {url for url_list in self.candidates.values() for response_time, url in url_list if response_time != 0}
+        self.due_at = {url: due for url, due in self.due_at.items() if url in pending}
+        for url in sorted(pending - set(self.due_at)):
+            if url in self.results:
+                self._schedule(url, now + self._revalidate_interval(url) * ValidationStore._spread(url))
+            else:
+                self._schedule(url, now)
+
+    # 重新排序，返回排名是否变化；record 为真时先把本周期的复验结果写入验证结果库
+    def rank(self, record: bool = False) -> bool:
+        self.source_manager.sources = {channel_name: list(url_list) for channel_name, url_list in self.candidates.items()}
+        if record:
+            self.record_run()
+        self.source_manager.apply_validation(self.results, {}, samples=1)
+        ranking = self._ranking()
+        changed = ranking != self.ranking
+        self.ranking = ranking
+        return changed
+
+    # 下载到期的源，返回是否有源的内容发生变化
+    def refetch_due(self, now: float) -> bool:
+        due_urls = []
+        while self.source_heap and self.source_heap[0][0] <= now:
+            due_urls.append(heapq.heappop(self.source_heap)[1])
+        if not due_urls:
+            return False
+
+        changed = False
+        for url, data in fetch_all_sources(due_urls, cache=self.fetch_cache, scheduler=self.scheduler):
+            pairs = parse_source_bytes(data, self.channel_dictionaries, self.parse_cache)[0] if data is not None else None
+            if pairs is not None and pairs != self.source_pairs[url]:
+                print(f"源内容变化: {url} ({len(self.source_pairs[url])} -> {len(pairs)} 条)")
+                self.source_pairs[url] = pairs
+                self.source_interval[url] = self.refetch_interval
+                changed = True
+            elif pairs is not None:
+                self.source_interval[url] = min(self.refetch_max_interval, self.source_interval[url] * 2)
+            heapq.heappush(self.source_heap, (time.time() + self.source_interval[url], url))
+        return changed
+
+    # 复验最多 batch_size 个到期的地址，返回本轮的探测结果
+    def revalidate_due(self, now: float) -> Dict[str, ProbeResult]:
+        due_urls = []
+        while self.due_heap and self.due_heap[0][0] <= now and len(due_urls) < self.batch_size:
+            due, url = heapq.heappop(self.due_heap)
+            if self.due_at.get(url) == due:
+                due_urls.append(url)
+        if not due_urls:
+            return {}
+
+        validator = AsyncStreamValidator(concurrency=len(due_urls), dns_cache=self.dns_cache, scheduler=self.scheduler)
+        probe_results = asyncio.run(validator.validate_async(due_urls))
+        self.probe_count += len(probe_results)
+        self.run_results.update(probe_results)
+        for url, result in probe_results.items():
+            self.results[url] = result
+            if result.ok and result.latency is not None:
+                self.samples.setdefault(url, deque(maxlen=LATENCY_SAMPLES)).append(result.latency)
+                self.source_manager.latency_stats[url] = summarize_latencies(list(self.samples[url]))
+            else:
+                self.samples.pop(url, None)
+                self.source_manager.latency_stats.pop(url, None)
+        return probe_results
+
+    # 一个周期结束：每个地址只按最近一次结果计一次运行（连续失败次数、得分），失效地址过滤器按时间轮换
+    def record_run(self) -> None:
+        self.source_manager.record_results(self.run_results)
+        dead_filter = self.source_manager.dead_filter
+        if dead_filter is not None:
+            dead_filter.rotate()
+            dead_filter.save()
+        print(f"监视周期结束: {len(self.run_results)} 个地址的复验结果写入验证结果库")
+        self.run_results = {}
+        self.run_started = time.time()
+
+    def _reschedule(self, urls: Iterable[str]) -> None:
+        now = time.time()
+        for url in urls:
+            if url in self.due_at:
+                self._schedule(url, now + self._revalidate_interval(url))
+
+    # 一直运行到 duration 秒后（None 表示直到 Ctrl+C）
+    def run(self, duration: Optional[float] = None) -> None:
+        self.rebuild()
+        if self.rank():
+            self.output_count = write_outputs(self.source_manager, self.channel_dictionaries)
+        print(f"进入监视模式: {len(self.due_at)} 个候选地址, {len(self.source_pairs)} 个源, 每 {self.tick} 秒最多复验 {self.batch_size} 个")
+        stop_at = time.time() + duration if duration is not None else None
+        try:
+            while stop_at is None or time.time() < stop_at:
+                tick_start = time.time()
+                rebuilt = self.refetch_due(tick_start)
+                if rebuilt:
+                    self.rebuild()
+                probe_results = self.revalidate_due(tick_start)
+                run_due = time.time() >= self.run_started + self.run_period
+                if rebuilt or probe_results or run_due:
+                    if self.rank(record=run_due):
+                        self.rewrite_count += 1
+                        print(f"排名变化，重写输出文件 (第 {self.rewrite_count} 次, 已复验 {self.probe_count} 次)")
+                        self.output_count = write_outputs(self.source_manager, self.channel_dictionaries)
+                    self._reschedule(probe_results)
+                wait = self.tick - (time.time() - tick_start)
+                if stop_at is not None:
+                    wait = min(wait, stop_at - time.time())
+                if wait > 0:
+                    time.sleep(wait)
+        except KeyboardInterrupt:
+            print("监视模式已停止")
+        # 退出时把未满一个周期的复验结果也写入，下次运行接着计数
+        if self.run_results:
+            self.rank(record=True)
+        print(f"监视模式结束: 复验 {self.probe_count} 次, 重写输出文件 {self.rewrite_count} 次")
+
+# 打印频道各地址的历史得分（成功率、平均延迟、运行次数、所在主机成功率）
+def show_channel_scores(channel_name: str) -> None:
+    validation_store = ValidationStore()
+    rows = validation_store.channel_scores(channel_name)
+    validation_store.close()
+    print(f"频道 {channel_name} 的历史得分: {len(rows)} 个地址")
+    for url, success, latency, runs, host_success in rows:
+        latency_text = f"{latency:.3f}s" if latency is not None else "-"
+        host_text = f"{host_success:.2f}" if host_success is not None else "-"
+        print(f"  成功率 {success:.2f}  延迟 {latency_text}  次数 {runs}  主机成功率 {host_text}  {url}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="抓取、验证并输出直播源")
+    parser.add_argument('--processes', type=int, default=1, help="本机验证进程数，大于 1 时按主机哈希分片验证")
+    parser.add_argument('--candidates', default=CANDIDATES_FILE, help="候选文件路径")
+    parser.add_argument('--export-candidates', action='store_true', help="只抓取解析并导出候选文件，不验证")
+    parser.add_argument('--validate-shard', metavar='I/N', help="只验证候选文件中的第 I 个分片（共 N 个）")
+    parser.add_argument('--shard-output', help="分片结果文件路径，默认 .cache/shards/shard-I-of-N.json")
+    parser.add_argument('--no-pipeline', action='store_true', help="下载、解析、验证分阶段执行，不做流水线验证")
+    parser.add_argument('--time-budget', type=float, help="验证时间预算（秒），用完后用已有结果输出")
+    parser.add_argument('--positive-ttl', type=float, default=VALIDATION_POSITIVE_TTL,
+                        help="有效验证结果的最长复用时间（秒），超过后重新探测")
+    parser.add_argument('--show-scores', metavar='CHANNEL', help="显示某个频道各地址的历史得分后退出")
+    parser.add_argument('--from-stage', choices=PIPELINE_STAGES, default='fetch',
+                        help="从指定阶段开始，前面的阶段使用上次运行保存的产物（.cache/stages）")
+    parser.add_argument('--merge-shards', nargs='+', metavar='FILE', help="合并分片结果文件，排序后输出")
+    parser.add_argument('--watch', action='store_true', help="首次输出后常驻运行，持续复验和重新下载，排名变化时更新输出文件")
+    parser.add_argument('--watch-duration', type=float, help="监视模式运行多少秒后退出，默认一直运行到 Ctrl+C")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.show_scores:
+        show_channel_scores(args.show_scores)
+        return
+    if args.validate_shard:
+        shard_index, shard_count = parse_shard_spec(args.validate_shard)
+        output_path = args.shard_output or shard_output_path(shard_index, shard_count)
+        count = validate_shard(args.candidates, shard_index, shard_count, output_path)
+        print(f"分片结果已保存到: {output_path} ({count} 条)")
+        return
+
+    print("正在读取黑名单...")
+    # 只读取blackhost_count.txt作为黑名单
+    blacklist = read_list_from_txt('assets/whitelist-blacklist/blackhost_count.txt')
+    print(f"黑名单行数: {len(blacklist)}")
+
+    print("正在读取白名单...")
+    whitelist = read_list_from_txt('assets/whitelist-blacklist/whitelist.txt', is_blacklist=False)
+    print(f"白名单行数: {len(whitelist)}")
+
+    print("正在读取频道字典...")
+    channel_dictionaries = load_channel_dictionaries()
+
+    # 频道在字典中的顺序，验证时靠前的频道优先
+    channel_order = {}
+    for channel_names in channel_dictionaries.values():
+        for channel_name in channel_names:
+            channel_order.setdefault(channel_name, len(channel_order))
+
+    print("正在读取URL列表...")
+    urls = read_txt_to_array('assets/urls.txt')
+    print(f"读取到 {len(urls)} 个URL")
+
+    # 创建频道源管理器，传入黑名单
+    blacklist_index = BlacklistIndex(blacklist)
+    print(f"黑名单规则数: {len(blacklist_index)}")
+    validation_store = ValidationStore(positive_ttl=args.positive_ttl)
+    dead_filter = DeadUrlFilter()
+    source_manager = ChannelSourceManager(blacklist=blacklist_index, validation_store=validation_store, dead_filter=dead_filter)
+
+    # 并发下载所有URL，下载完的源立即在下载线程中解析；按源序号合并，保证输出稳定
+    print("\n开始处理所有URL...")
+    fetch_cache = FetchCache()
+    parse_cache = ParseCache(channel_dictionaries)
+    request_scheduler = RequestScheduler()
+    artifacts = StageArtifacts()
+    start_stage = PIPELINE_STAGES.index(args.from_stage)
+    if args.watch and (args.from_stage not in ('fetch', 'parse') or args.merge_shards or args.export_candidates):
+        raise SystemExit("监视模式需要各源的内容，只能从 fetch 或 parse 阶段开始")
+    source_pairs = {}  # 源序号 -> (源地址, 解析出的 (频道名, 地址))，监视模式使用
+    if args.merge_shards:
+        # 跳过抓取，直接用候选文件和各分片的结果排序
+        known_results, _ = load_candidates(args.candidates, source_manager)
+        source_manager.apply_validation(known_results, merge_shard_results(args.merge_shards), scheduler=request_scheduler)
+    elif args.from_stage == 'output':
+        print("使用上次保存的排序结果")
+        artifacts.load_ranked(source_manager)
+    elif args.from_stage == 'rank':
+        print("使用上次保存的候选和验证结果重新排序")
+        artifacts.load_candidates(source_manager)
+        source_manager.apply_validation(artifacts.load_validation(source_manager), {}, samples=1)
+    elif args.from_stage == 'validate':
+        print("使用上次保存的候选重新验证")
+        artifacts.load_candidates(source_manager)
+        time_budget = args.time_budget if args.time_budget is not None else VALIDATION_TIME_BUDGET
+        source_manager.validate_and_sort_sources(scheduler=request_scheduler, time_budget=time_budget, channel_order=channel_order)
+    else:
+        # 流水线模式下边下载边验证，源下载和探测共用同一个调度器
+        use_pipeline = VALIDATION_PIPELINE and not args.no_pipeline and not args.export_candidates and args.processes <= 1
+        time_budget = args.time_budget if args.time_budget is not None else VALIDATION_TIME_BUDGET
+        if use_pipeline:
+            source_manager.pipeline = ValidationPipeline(AsyncStreamValidator(scheduler=request_scheduler), validation_store,
+                                                         is_retained=source_manager.is_retained,
+                                                         channel_order=channel_order, time_budget=time_budget)
+
+        # 各下载线程下载完立即解析，按源序号决定重复地址的归属和候选顺序，结果与线程先后无关
+        def process_fetched(source_index: int, url: str, data: Optional[bytes]) -> None:
+            print(f"\n开始处理URL: {url}")
+            pairs = []
+            if data is not None:
+                pairs = process_source_bytes(data, source_manager, channel_dictionaries, parse_cache=parse_cache, source_index=source_index)
+            source_pairs[source_index] = (url, pairs)
+
+        if args.from_stage == 'parse':
+            print("使用上次保存的源内容重新解析")
+            for source_index, (url, data) in enumerate(artifacts.load_fetched()):
+                process_fetched(source_index, url, data)
+        else:
+            fetched_sources = fetch_all_sources([url for url in urls if url.startswith("http")], cache=fetch_cache,
+                                                scheduler=request_scheduler, on_fetched=process_fetched)
+            artifacts.save_fetched(fetched_sources)
+        parse_cache.prune()
+        print(parse_cache.summary())
+
+        # 处理精选源文件
+        process_me_file(source_manager, channel_dictionaries)
+        artifacts.save_candidates(source_manager)
+
+        if args.export_candidates:
+            count = export_candidates(source_manager, args.candidates)
+            print(f"候选文件已保存到: {args.candidates} (需要探测 {count} 个地址)")
+            validation_store.close()
+            return
+
+        # 验证所有源并选择最快的10个
+        if use_pipeline:
+            source_manager.print_ingest_summary()
+            known_results, probe_results = source_manager.pipeline.finish()
+            source_manager.cut_short_channels = source_manager.pipeline.cut_short
+            deadline = source_manager.pipeline.deadline
+            source_manager.pipeline = None
+            source_manager.apply_validation(known_results, probe_results, scheduler=request_scheduler,
+                                            validation_started=timestart.timestamp(), deadline=deadline)
+        elif args.processes > 1:
+            validate_with_processes(source_manager, args.processes, scheduler=request_scheduler)
+        else:
+            source_manager.validate_and_sort_sources(scheduler=request_scheduler, time_budget=time_budget, channel_order=channel_order)
+
+    if start_stage < PIPELINE_STAGES.index('rank'):
+        artifacts.save_validation(source_manager)
+    if start_stage < PIPELINE_STAGES.index('output'):
+        artifacts.save_ranked(source_manager)
+
+    total_count = write_outputs(source_manager, channel_dictionaries)
+
+    if args.watch:
+        watcher = SourceWatcher(source_manager, channel_dictionaries, dict(source_pairs[index] for index in sorted(source_pairs)),
+                                fetch_cache=fetch_cache, parse_cache=parse_cache)
+        watcher.run(args.watch_duration)
+        if watcher.output_count is not None:
+            total_count = watcher.output_count
 
     # 执行结束时间
     timeend = datetime.now()
@@ -440,7 +3215,16 @@ def main():
 
     print(f"执行时间: {minutes} 分 {seconds} 秒")
     print(f"blacklist行数: {len(blacklist)}")
-    print(f"{m3u_output_file}频道数: {total_count}")
+    print(blacklist_index.summary())
+    print(fetch_cache.summary())
+    print(parse_cache.summary())
+    print(validation_store.summary())
+    dead_filter.save()
+    print(f"{dead_filter.summary()}, 跳过候选 {source_manager.dead_skipped} 个")
+    if source_manager.cut_short_channels:
+        print(f"时间预算内未验证完的频道 ({len(source_manager.cut_short_channels)} 个): {', '.join(source_manager.cut_short_channels)}")
+    validation_store.close()
+    print(f"{M3U_OUTPUT_FILE}频道数: {total_count}")
 
 if __name__ == "__main__":
     main()